@@ -1,3 +1,4 @@
+import django
 from pkg_resources import get_distribution, DistributionNotFound
 
 try:
@@ -6,6 +7,9 @@ except DistributionNotFound:
     # package is not installed
     pass
 
+if django.VERSION < (3, 2):
+    default_app_config = "authority.apps.AuthorityConfig"
+
 LOADING = False
 
 
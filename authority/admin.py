@@ -1,14 +1,27 @@
+from datetime import datetime
+
+import django
 from django import forms
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
 from django.http import HttpResponseRedirect
 from django.utils.translation import ugettext, ungettext, ugettext_lazy as _
 from django.shortcuts import render
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
+from django.utils.text import smart_split, unescape_string_literal
 from django.forms.formsets import all_valid
+from django.forms.models import ModelChoiceIterator
 from django.contrib import admin
 from django.contrib.admin import actions, helpers
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
 from django.contrib.contenttypes.admin import GenericTabularInline
+from django.contrib.contenttypes.forms import BaseGenericInlineFormSet
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import PermissionDenied
 
 try:
     from django.utils.encoding import force_text
@@ -16,6 +29,7 @@ except ImportError:
     from django.utils.encoding import force_unicode as force_text
 
 from authority.models import Permission
+from authority.signals import permissions_changed
 from authority.widgets import GenericForeignKeyRawIdWidget
 from authority.utils import get_choices_for
 
@@ -33,9 +47,114 @@ class PermissionInline(GenericTabularInline):
         return super(PermissionInline, self).formfield_for_dbfield(db_field, **kwargs)
 
 
+class CachedModelChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self.field.get_objects():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.get_objects()) + (self.field.empty_label is not None)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    A ModelChoiceField that loads its objects only once and shares them with
+    the copies made for every form, instead of querying them again to render
+    and clean each form. The objects can also be given up front.
+    """
+
+    iterator = CachedModelChoiceIterator
+
+    def __init__(self, queryset, objects=None, *args, **kwargs):
+        self._cache = {}
+        if objects is not None:
+            self._cache["objects"] = objects
+        super(CachedModelChoiceField, self).__init__(queryset, *args, **kwargs)
+
+    def __deepcopy__(self, memo):
+        result = super(CachedModelChoiceField, self).__deepcopy__(memo)
+        result._cache = self._cache
+        return result
+
+    def get_objects(self):
+        if "objects" not in self._cache:
+            self._cache["objects"] = list(self.queryset)
+        return self._cache["objects"]
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if "lookup" not in self._cache:
+            self._cache["lookup"] = dict(
+                ("%s" % self.prepare_value(obj), obj) for obj in self.get_objects()
+            )
+        try:
+            return self._cache["lookup"]["%s" % self.prepare_value(value)]
+        except KeyError:
+            raise ValidationError(
+                self.error_messages["invalid_choice"], code="invalid_choice"
+            )
+
+
+class ActionPermissionForm(forms.ModelForm):
+    def _get_validation_exclusions(self):
+        # The users, groups and permissions were looked up among the loaded
+        # ones already, and the formset checks the permissions of an object
+        # for duplicates, so the model validation doesn't have to query them
+        # again for every form.
+        exclude = super(ActionPermissionForm, self)._get_validation_exclusions()
+        exclude.extend(
+            name
+            for name, field in self.fields.items()
+            if isinstance(field, CachedModelChoiceField)
+        )
+        return exclude
+
+
+class ActionPermissionFormSet(BaseGenericInlineFormSet):
+    """
+    A formset for the permissions of an object that can be given the
+    permissions up front, to edit the permissions of many objects without
+    querying them object by object.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.permissions = kwargs.pop("permissions", None)
+        super(ActionPermissionFormSet, self).__init__(*args, **kwargs)
+
+    def get_queryset(self):
+        if self.permissions is None:
+            return super(ActionPermissionFormSet, self).get_queryset()
+        return self.permissions
+
+    def add_fields(self, form, index):
+        super(ActionPermissionFormSet, self).add_fields(form, index)
+        if self.permissions is not None:
+            name = self.model._meta.pk.name
+            field = form.fields[name]
+            form.fields[name] = CachedModelChoiceField(
+                field.queryset,
+                objects=self.permissions,
+                initial=field.initial,
+                required=field.required,
+                widget=field.widget,
+            )
+
+
 class ActionPermissionInline(PermissionInline):
     raw_id_fields = ()
     template = "admin/edit_inline/action_tabular.html"
+    form = ActionPermissionForm
+    formset = ActionPermissionFormSet
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # The same users and groups are offered in every form of the action.
+        kwargs.setdefault("form_class", CachedModelChoiceField)
+        return super(ActionPermissionInline, self).formfield_for_foreignkey(
+            db_field, request, **kwargs
+        )
 
 
 class ActionErrorList(forms.utils.ErrorList):
@@ -47,6 +166,80 @@ class ActionErrorList(forms.utils.ErrorList):
                 self.extend(errors_in_inline_form.values())
 
 
+def get_object_permissions(queryset):
+    """
+    Get the permissions on the objects of the queryset in a single query, as
+    a dict of lists keyed by the object ids.
+    """
+    content_type = ContentType.objects.get_for_model(queryset.model)
+    permissions = {}
+    perms = Permission.objects.filter(
+        content_type=content_type, object_id__in=queryset.values("pk")
+    ).order_by("pk")
+    for perm in perms:
+        permissions.setdefault(perm.object_id, []).append(perm)
+    return permissions
+
+
+def save_permission_formsets(formsets):
+    """
+    Save the permission formsets of the edit_permissions action with bulk
+    operations instead of a query per permission, sending a single
+    permissions_changed signal.
+    """
+    batch_size = getattr(settings, "AUTHORITY_BULK_BATCH_SIZE", 1000)
+    new_perms = []
+    changed_perms = []
+    changed_fields = set()
+    deleted_pks = []
+    user_pks = set()
+    group_pks = set()
+    for formset in formsets:
+        # The users and groups the changed permissions belonged to before.
+        for form in formset.initial_forms:
+            if form.instance.pk is not None and (
+                form in formset.deleted_forms or form.has_changed()
+            ):
+                user_pks.add(form.initial.get("user"))
+                group_pks.add(form.initial.get("group"))
+        formset.save(commit=False)
+        new_perms.extend(formset.new_objects)
+        for perm, fields in formset.changed_objects:
+            changed_perms.append(perm)
+            changed_fields.update(fields)
+        deleted_pks.extend(perm.pk for perm in formset.deleted_objects)
+
+    # The bulk queries skip Permission.save(), which sets the approval date.
+    now = datetime.now()
+    for perm in changed_perms + new_perms:
+        if perm.approved and not perm.date_approved:
+            perm.date_approved = now
+            if perm in changed_perms:
+                changed_fields.add("date_approved")
+
+    if deleted_pks:
+        Permission.objects.filter(pk__in=deleted_pks).delete_without_signals()
+    if changed_perms:
+        if django.VERSION >= (2, 2):
+            Permission.objects.bulk_update(
+                changed_perms, list(changed_fields), batch_size=batch_size
+            )
+        else:
+            for perm in changed_perms:
+                perm.save(update_fields=list(changed_fields))
+    if new_perms:
+        Permission.objects.bulk_create(new_perms, batch_size=batch_size)
+    for perm in changed_perms + new_perms:
+        user_pks.add(perm.user_id)
+        group_pks.add(perm.group_id)
+    if deleted_pks or changed_perms or new_perms:
+        permissions_changed.send(
+            sender=Permission,
+            user_pks=user_pks - set([None]),
+            group_pks=group_pks - set([None]),
+        )
+
+
 def edit_permissions(modeladmin, request, queryset):
     opts = modeladmin.model._meta
     app_label = opts.app_label
@@ -60,34 +253,41 @@ def edit_permissions(modeladmin, request, queryset):
         raise PermissionDenied
 
     inline = ActionPermissionInline(queryset.model, modeladmin.admin_site)
+    FormSet = inline.get_formset(request)
+    fieldsets = list(inline.get_fieldsets(request))
+    objects = list(queryset)
+    permissions = get_object_permissions(queryset)
     formsets = []
-    for obj in queryset:
+    for obj in objects:
         prefixes = {}
-        FormSet = inline.get_formset(request, obj)
         prefix = "%s-%s" % (FormSet.get_default_prefix(), obj.pk)
         prefixes[prefix] = prefixes.get(prefix, 0) + 1
         if prefixes[prefix] != 1:
             prefix = "%s-%s" % (prefix, prefixes[prefix])
         if request.POST.get("post"):
             formset = FormSet(
-                data=request.POST, files=request.FILES, instance=obj, prefix=prefix
+                data=request.POST,
+                files=request.FILES,
+                instance=obj,
+                prefix=prefix,
+                permissions=permissions.get(obj.pk, []),
             )
         else:
-            formset = FormSet(instance=obj, prefix=prefix)
+            formset = FormSet(
+                instance=obj, prefix=prefix, permissions=permissions.get(obj.pk, [])
+            )
         formsets.append(formset)
 
     media = modeladmin.media
     inline_admin_formsets = []
     for formset in formsets:
-        fieldsets = list(inline.get_fieldsets(request))
         inline_admin_formset = helpers.InlineAdminFormSet(inline, formset, fieldsets)
         inline_admin_formsets.append(inline_admin_formset)
         media = media + inline_admin_formset.media
 
     if request.POST.get("post"):
         if all_valid(formsets):
-            for formset in formsets:
-                formset.save()
+            save_permission_formsets(formsets)
         else:
             modeladmin.message_user(
                 request,
@@ -135,10 +335,136 @@ edit_permissions.short_description = _(
 )
 
 
+def get_prefix_query(field_name, prefix, using):
+    """
+    Get a case sensitive prefix lookup of a field. SQLite only uses an index
+    for the case insensitive LIKE with a case insensitive index, so there
+    the prefix is looked up as a range of values as well.
+    """
+    query = Q(**{"%s__startswith" % field_name: prefix})
+    if connections[using].vendor == "sqlite":
+        query &= Q(
+            **{
+                "%s__gte" % field_name: prefix,
+                "%s__lt" % field_name: prefix + u"\uffff",
+            }
+        )
+    return query
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that doesn't count all the rows of large tables. The number
+    of rows of an unfiltered table is estimated from the statistics of the
+    database where available, and filtered rows are only counted up to
+    count_limit. ``count_estimated`` and ``count_limited`` tell whether the
+    count isn't exact.
+    """
+
+    count_limit = 10000
+    count_estimated = False
+    count_limited = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.get_estimated_count()
+            if estimate is not None and estimate > self.count_limit:
+                self.count_estimated = True
+                return estimate
+        # Count one more row to know whether there are more than the limit.
+        count = queryset[: self.count_limit + 1].count()
+        if count > self.count_limit:
+            self.count_limited = True
+            return self.count_limit
+        return count
+
+    def get_estimated_count(self):
+        """
+        Get the estimated number of rows of the table from the statistics of
+        PostgreSQL and MySQL, or None on other databases.
+        """
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == "postgresql":
+            sql = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass"
+        elif connection.vendor == "mysql":
+            sql = (
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s"
+            )
+        else:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        # PostgreSQL returns -1 for tables that weren't analyzed yet.
+        if row is None or row[0] is None or row[0] < 0:
+            return None
+        return int(row[0])
+
+
+KEYSET_VAR = "before"
+
+
+class PermissionChangeList(ChangeList):
+    """
+    A changelist that can page through the permissions listed newest first
+    by their primary key, with the ``before`` parameter, which unlike the
+    offset of a page number can use the primary key index however deep the
+    page is.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.keyset_before = request.GET.get(KEYSET_VAR)
+        super(PermissionChangeList, self).__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(PermissionChangeList, self).get_filters_params(params)
+        lookup_params.pop(KEYSET_VAR, None)
+        return lookup_params
+
+    def get_queryset(self, request):
+        queryset = super(PermissionChangeList, self).get_queryset(request)
+        queryset = queryset.with_content_objects()
+        # Only the default order is the order of the primary key.
+        self.keyset_ordered = ORDER_VAR not in self.params and self.get_ordering(
+            request, self.root_queryset
+        ) == ["-pk"]
+        if self.keyset_before is not None and self.keyset_ordered:
+            try:
+                queryset = queryset.filter(pk__lt=int(self.keyset_before))
+            except ValueError:
+                raise IncorrectLookupParameters
+        return queryset
+
+    def get_results(self, request):
+        super(PermissionChangeList, self).get_results(request)
+        self.keyset_next_url = None
+        if self.keyset_ordered and self.multi_page:
+            results = list(self.result_list)
+            if len(results) == self.list_per_page:
+                self.keyset_next_url = self.get_query_string(
+                    {KEYSET_VAR: results[-1].pk}, [PAGE_VAR]
+                )
+
+
 class PermissionAdmin(admin.ModelAdmin):
-    list_display = ("codename", "content_type", "user", "group", "approved")
+    list_display = (
+        "codename",
+        "content_type",
+        "content_object",
+        "user",
+        "group",
+        "approved",
+    )
     list_filter = ("approved", "content_type")
-    search_fields = ("user__username", "group__name", "codename")
+    list_select_related = ("content_type", "user", "group")
+    search_fields = ("codename", "user__username", "group__name")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     raw_id_fields = ("user", "group", "creator")
     generic_fields = ("content_object",)
     actions = ["approve_permissions"]
@@ -164,6 +490,36 @@ class PermissionAdmin(admin.ModelAdmin):
                     break
         return super(PermissionAdmin, self).formfield_for_dbfield(db_field, **kwargs)
 
+    def get_changelist(self, request, **kwargs):
+        return PermissionChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search like the admin does for the search_fields, except that the
+        codenames are matched by their prefix case sensitively. Unlike the
+        case insensitive match of "^codename", that can use the codename
+        indexes of large tables, and the codenames made of the permission
+        labels and checks are lowercase anyway.
+
+        The codenames, users and groups are searched in separate subqueries
+        instead of an OR across joins, so that each can use its index.
+        """
+        opts = self.model._meta
+        users = opts.get_field("user").remote_field.model._default_manager
+        groups = opts.get_field("group").remote_field.model._default_manager
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            codenames = self.model._default_manager.using(queryset.db).filter(
+                get_prefix_query("codename", bit, queryset.db)
+            )
+            queryset = queryset.filter(
+                Q(pk__in=codenames.values("pk"))
+                | Q(user__in=users.filter(username__icontains=bit).values("pk"))
+                | Q(group__in=groups.filter(name__icontains=bit).values("pk"))
+            )
+        return queryset, False
+
     def queryset(self, request):
         user = request.user
         if user.is_superuser or user.has_perm("permissions.change_foreign_permissions"):
@@ -171,14 +527,13 @@ class PermissionAdmin(admin.ModelAdmin):
         return super(PermissionAdmin, self).queryset(request).filter(creator=user)
 
     def approve_permissions(self, request, queryset):
-        for permission in queryset:
-            permission.approve(request.user)
+        count = queryset.approve(request.user)
         message = ungettext(
             "%(count)d permission successfully approved.",
             "%(count)d permissions successfully approved.",
-            len(queryset),
+            count,
         )
-        self.message_user(request, message % {"count": len(queryset)})
+        self.message_user(request, message % {"count": count})
 
     approve_permissions.short_description = _("Approve selected permissions")
 
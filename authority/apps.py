@@ -0,0 +1,28 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db import DatabaseError
+
+
+class AuthorityConfig(AppConfig):
+    name = "authority"
+    verbose_name = "Authority"
+
+    def ready(self):
+        """
+        Optionally discover the permission classes of all apps and load the
+        content types of their models right away, so that the first request
+        of every process doesn't have to.
+        """
+        from authority import autodiscover
+        from authority.sites import site
+
+        if getattr(settings, "AUTHORITY_AUTODISCOVER", False):
+            autodiscover()
+        site.build_indexes()
+        if getattr(settings, "AUTHORITY_PRELOAD_CONTENT_TYPES", False):
+            try:
+                site.preload_content_types()
+            except DatabaseError:
+                # The content types table doesn't exist yet, e.g. on the
+                # first migrate.
+                pass
@@ -0,0 +1,116 @@
+"""
+The tests of the async permission API, imported by the tests module on
+Django 3.1 or later only.
+"""
+import asyncio
+from contextlib import contextmanager
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import RequestFactory, TestCase
+
+from authority import asynchronous
+from authority.asynchronous import acall_check
+from authority.context import PermissionContext
+from authority.decorators import permission_required
+from authority.middleware import PermissionContextMiddleware
+from authority.models import Permission
+from authority.tests import FIXTURES, QUERY, User, UserPermission
+
+
+class AsyncPermissionTestCase(TestCase):
+    """
+    Tests the async permission API.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.other = User.objects.create(username="other", email="other@example.com")
+        UserPermission(self.user).assign(check="delete_user", content_object=self.user)
+        self.check = UserPermission(self.user)
+        # Cache the content type.
+        Permission.objects.get_content_type(User)
+
+    @contextmanager
+    def assertNumHops(self, num):
+        hops = []
+
+        def counting_sync_to_async(func):
+            hops.append(func)
+            return sync_to_async(func)
+
+        with mock.patch.object(asynchronous, "sync_to_async", counting_sync_to_async):
+            yield
+        self.assertEqual(len(hops), num, hops)
+
+    def prime(self):
+        # Prime authority's cache and Django's permission cache of the user.
+        self.check.has_perm("user_permission.delete_user", self.user)
+        self.user.has_perm("auth.delete_user")
+
+    async def test_ahas_perm(self):
+        with self.assertNumHops(1):
+            self.assertTrue(
+                await self.check.ahas_perm("user_permission.delete_user", self.user)
+            )
+        # Answered by the primed cache from now on, without a thread hop.
+        with self.assertNumHops(0):
+            self.assertFalse(
+                await self.check.ahas_perm("user_permission.delete_user", self.other)
+            )
+
+    async def test_ahas_perm_for_objects(self):
+        with self.assertNumHops(1):
+            self.assertEqual(
+                await self.check.ahas_perm_for_objects(
+                    "user_permission.delete_user", [self.other, self.user]
+                ),
+                [False, True],
+            )
+        with self.assertNumHops(0):
+            self.assertEqual(
+                await self.check.ahas_perm_for_objects(
+                    "user_permission.delete_user", [self.user, self.other]
+                ),
+                [True, False],
+            )
+
+    async def test_acan(self):
+        # Django's permissions and authority's cache are loaded in one hop.
+        with self.assertNumHops(1):
+            self.assertTrue(await self.check.acan("delete", True, self.user))
+        await sync_to_async(self.prime)()
+        with self.assertNumHops(0):
+            self.assertTrue(await self.check.acan("delete", True, self.user))
+            self.assertFalse(await self.check.acan("delete", True, self.other))
+            self.assertTrue(await acall_check(self.check.delete_user, self.user))
+            self.assertFalse(await acall_check(self.check.delete_user, self.other))
+
+    async def test_permission_required(self):
+        async def view(request, pk):
+            return "granted"
+
+        decorated = permission_required(
+            "user_permission.delete_user", (User, "pk", "pk")
+        )(view)
+        request = RequestFactory().get("/")
+        request.user = self.user
+        with self.assertNumHops(1):
+            self.assertEqual(await decorated(request, pk=self.user.pk), "granted")
+        request = RequestFactory().get("/")
+        request.user = self.user
+        with self.assertNumHops(1):
+            response = await decorated(request, pk=self.other.pk)
+        self.assertEqual(response.status_code, 302)
+
+    async def test_middleware(self):
+        async def get_response(request):
+            return request
+
+        # Django runs the middleware without a thread hop.
+        middleware = PermissionContextMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = await middleware(RequestFactory().get("/"))
+        self.assertIsInstance(request.permission_context, PermissionContext)
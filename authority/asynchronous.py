@@ -0,0 +1,143 @@
+"""
+The async permission API, which requires Django 3.0 or later.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Model
+from django.db.models.base import ModelBase
+
+MODEL_BACKEND = "django.contrib.auth.backends.ModelBackend"
+
+
+def get_cached_django_perm(user, perm):
+    """
+    Answer ``user.has_perm(perm)`` from the permissions Django's
+    ModelBackend cached on the user. Returns None if that would require
+    querying the database.
+    """
+    if user.is_active and user.is_superuser:
+        return True
+    perm_cache = getattr(user, "_perm_cache", None)
+    if user.is_active and perm_cache is not None and perm in perm_cache:
+        return True
+    # Other backends may grant permissions the ModelBackend doesn't know.
+    if list(settings.AUTHENTICATION_BACKENDS) != [MODEL_BACKEND]:
+        return None
+    if not user.is_active:
+        return False
+    if perm_cache is None:
+        return None
+    return False
+
+
+async def acall_check(check, *args, **kwargs):
+    """
+    Call a check returned by ``get_check``. Generated checks the primed
+    caches can answer don't leave the event loop, everything else runs in a
+    single thread hop.
+    """
+    perm_instance = getattr(check, "__self__", None)
+    check_name = getattr(check, "check_name", None)
+    if check_name is not None and isinstance(perm_instance, AsyncPermissionMixin):
+        granted = perm_instance._get_primed_can(check_name, check.generic, args)
+        if granted or (granted is False and not check.check_func):
+            return granted
+    return await sync_to_async(check)(*args, **kwargs)
+
+
+class AsyncPermissionMixin(object):
+    """
+    The async counterparts of the permission checks of ``BasePermission``.
+
+    Checks answered by the primed caches don't leave the event loop.
+    Everything else, like priming the cache, runs in a single thread hop.
+    """
+
+    async def ahas_perm(self, perm, obj, check_groups=True, approved=True):
+        """
+        Async version of ``has_perm``.
+        """
+        granted = self._get_primed_perm(perm, obj, check_groups, approved)
+        if granted is None:
+            granted = await sync_to_async(self.has_perm)(
+                perm, obj, check_groups, approved
+            )
+        return granted
+
+    async def ahas_perm_for_objects(
+        self, perm, objs, check_groups=True, approved=True
+    ):
+        """
+        Async version of ``has_perm_for_objects``.
+        """
+        objs = list(objs)
+        results = [
+            self._get_primed_perm(perm, obj, check_groups, approved) for obj in objs
+        ]
+        if None in results:
+            results = await sync_to_async(self.has_perm_for_objects)(
+                perm, objs, check_groups, approved
+            )
+        return results
+
+    def _get_primed_can(self, check, generic, args):
+        """
+        Answer ``can`` from Django's cached permissions of the user and the
+        primed caches only. Returns None if that would require querying the
+        database.
+        """
+        if not args:
+            args = [self.model]
+        granted = False
+        for obj in args:
+            if isinstance(obj, Model):
+                model = obj.__class__
+            elif isinstance(obj, ModelBase):
+                model = obj
+            else:
+                # skip this obj if it's not a model class or instance
+                continue
+            codename, django_codename = self.get_compiled_check(check, model, generic)
+            answers = []
+            # first check Django's permission system
+            if self.user:
+                answers.append(get_cached_django_perm(self.user, django_codename))
+            # then check authority's per object permissions
+            if model is not obj and isinstance(obj, self.model):
+                answers.append(self._get_primed_perm(codename, obj))
+            if True in answers:
+                return True
+            if None in answers:
+                granted = None
+        return granted
+
+    async def acan(self, check, generic=False, *args, **kwargs):
+        """
+        Async version of ``can``.
+        """
+        granted = self._get_primed_can(check, generic, args)
+        if granted is None:
+            granted = await sync_to_async(self.can)(check, generic, *args, **kwargs)
+        return granted
+
+
+def async_permission_required(
+    view_func, perm, lookup_variables, login_url, redirect_field_name, redirect_to_login
+):
+    """
+    The ``permission_required`` decorator for async views. Loading the user
+    and the objects to check, and the check itself run in one thread hop.
+    """
+    from authority.decorators import deny, has_permission
+
+    async def decorated(request, *args, **kwargs):
+        granted = await sync_to_async(has_permission)(
+            request, perm, lookup_variables, kwargs
+        )
+        if granted:
+            return await view_func(request, *args, **kwargs)
+        return deny(request, login_url, redirect_field_name, redirect_to_login)
+
+    return wraps(view_func)(decorated)
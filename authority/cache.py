@@ -0,0 +1,355 @@
+import hashlib
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+try:
+    from sys import intern
+except ImportError:
+    # Python 2 has intern as a builtin
+    pass
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import router, transaction
+
+try:
+    integer_types = (int, long)
+except NameError:
+    # Python 3 has no long type
+    integer_types = (int,)
+
+KEY_PREFIX = "authority"
+
+
+class PermissionSet(object):
+    """
+    A compact set of primed permissions. The object ids are grouped per
+    content type, codename and approval state, and once frozen stored in
+    sorted arrays of 64 bit integers which are searched with bisect. The
+    codenames are interned, so they are only stored once per process.
+
+    It is looked up like the dict of (object_id, content_type_id, codename,
+    approved) keys that was used before.
+    """
+
+    __slots__ = ("_object_ids",)
+
+    def __init__(self):
+        self._object_ids = {}
+
+    def add(self, object_id, content_type_id, codename, approved):
+        key = (content_type_id, intern(str(codename)), approved)
+        object_ids = self._object_ids.get(key)
+        if object_ids is None:
+            object_ids = self._object_ids[key] = set()
+        elif not isinstance(object_ids, set):
+            object_ids = self._object_ids[key] = set(object_ids)
+        object_ids.add(object_id)
+
+    def freeze(self):
+        """
+        Convert the object ids to sorted arrays, returns the set itself.
+        """
+        for key, object_ids in self._object_ids.items():
+            if isinstance(object_ids, set):
+                self._object_ids[key] = array("q", sorted(object_ids))
+        return self
+
+    def get(self, key, default=None):
+        object_id, content_type_id, codename, approved = key
+        object_ids = self._object_ids.get((content_type_id, codename, approved))
+        if object_ids is None:
+            return default
+        if isinstance(object_ids, set):
+            return True if object_id in object_ids else default
+        if not isinstance(object_id, integer_types):
+            # The pk of an unsaved or non integer keyed object, which can't
+            # be in the array of 64 bit integers.
+            return default
+        index = bisect_left(object_ids, object_id)
+        if index < len(object_ids) and object_ids[index] == object_id:
+            return True
+        return default
+
+    def __contains__(self, key):
+        return self.get(key, False)
+
+    def __iter__(self):
+        for key, object_ids in self._object_ids.items():
+            content_type_id, codename, approved = key
+            for object_id in object_ids:
+                yield (object_id, content_type_id, codename, approved)
+
+    def __len__(self):
+        return sum(len(object_ids) for object_ids in self._object_ids.values())
+
+    def __getstate__(self):
+        return self.freeze()._object_ids
+
+    def __setstate__(self, state):
+        self._object_ids = dict(
+            ((content_type_id, intern(str(codename)), approved), object_ids)
+            for (content_type_id, codename, approved), object_ids in state.items()
+        )
+
+
+class LocalCache(object):
+    """
+    A bounded least recently used cache living in the memory of the process.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            # Re-insert the key to mark it as the most recently used one.
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class PermissionCache(object):
+    """
+    A two tier cache for primed permissions, a ``LocalCache`` in front of a
+    cache of Django's cache framework shared by all processes.
+
+    Every user and group has a version number which is part of the keys of
+    everything cached for them. Bumping the version makes those entries stale
+    in both tiers at once.
+    """
+
+    def __init__(self, alias, timeout=DEFAULT_TIMEOUT, local_size=1000):
+        self.alias = alias
+        self.timeout = timeout
+        self.local = LocalCache(local_size)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version_key(self, kind, pk):
+        return "%s:version:%s:%s" % (KEY_PREFIX, kind, pk)
+
+    def get_versions(self, kind, pks):
+        """
+        Get the current version of the users or groups with the given pks.
+        """
+        keys = dict((self.version_key(kind, pk), pk) for pk in pks)
+        found = self.cache.get_many(list(keys))
+        versions = {}
+        for key, pk in keys.items():
+            version = found.get(key)
+            if version is None:
+                # Start from the current time instead of 0, so that a version
+                # evicted from the cache does not make stale entries valid.
+                version = int(time.time() * 1000)
+                if not self.cache.add(key, version, None):
+                    version = self.cache.get(key, version)
+            versions[pk] = version
+        return versions
+
+    def bump_versions(self, kind, pks, using=None):
+        """
+        Invalidate everything cached for the users or groups with the given
+        pks.
+
+        Inside a transaction of the given database the versions are bumped
+        again when it's committed. Until then other connections read the old
+        rows, and may cache them under the versions bumped first.
+        """
+        pks = list(pks)
+        for pk in pks:
+            try:
+                self.cache.incr(self.version_key(kind, pk))
+            except ValueError:
+                # No version yet, so nothing has been cached for it either.
+                pass
+        if pks and transaction.get_connection(using).in_atomic_block:
+            transaction.on_commit(
+                lambda: self.bump_versions(kind, pks, using), using=using
+            )
+
+    def make_key(self, name, versions, *parts):
+        """
+        Build a key from a name, the (kind, pk, version) tuples of every user
+        and group the cached value depends on and any additional parts.
+        """
+        digest = hashlib.md5(
+            ";".join("%s:%s:%s" % version for version in versions).encode("utf-8")
+        ).hexdigest()
+        return ":".join([KEY_PREFIX, name, digest] + ["%s" % part for part in parts])
+
+    def get(self, key):
+        """
+        Look up the key in the local and then in the shared cache.
+        """
+        value = self.local.get(key)
+        if value is None:
+            value = self.cache.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def get_many(self, keys):
+        """
+        Look up many keys at once, returns a dict of the keys found.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            for key, value in self.cache.get_many(missing).items():
+                self.local.set(key, value)
+                found[key] = value
+        return found
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+        self.local.set(key, value)
+
+    def set_many(self, data):
+        if data:
+            self.cache.set_many(data, self.timeout)
+            for key, value in data.items():
+                self.local.set(key, value)
+
+    def get_or_set(self, key, default):
+        """
+        Look up the key in both tiers, calling default to compute and store
+        the value if both miss.
+        """
+        value = self.get(key)
+        if value is None:
+            value = default()
+            self.set(key, value)
+        return value
+
+
+_permission_cache = None
+
+
+def get_permission_cache():
+    """
+    Get the shared permission cache as configured by the ``AUTHORITY_CACHE``
+    settings, or None if it's not enabled.
+    """
+    global _permission_cache
+    alias = getattr(settings, "AUTHORITY_CACHE", None)
+    if alias is None:
+        return None
+    timeout = getattr(settings, "AUTHORITY_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+    local_size = getattr(settings, "AUTHORITY_LOCAL_CACHE_SIZE", 1000)
+    if (
+        _permission_cache is None
+        or _permission_cache.alias != alias
+        or _permission_cache.timeout != timeout
+        or _permission_cache.local.max_size != local_size
+    ):
+        _permission_cache = PermissionCache(alias, timeout, local_size)
+    return _permission_cache
+
+
+def remember_permission_principals(sender, instance, raw=False, **kwargs):
+    """
+    Remember the user and group a Permission belonged to before saving it,
+    to invalidate both the old and the new ones afterwards.
+    """
+    if raw or instance.pk is None or get_permission_cache() is None:
+        return
+    instance._authority_old_principals = (
+        sender._default_manager.filter(pk=instance.pk)
+        .values_list("user_id", "group_id")
+        .first()
+    )
+
+
+def invalidate_permission(sender, instance, **kwargs):
+    """
+    Invalidate the cached permissions of the user and group of a saved or
+    deleted Permission.
+    """
+    permission_cache = get_permission_cache()
+    if permission_cache is None:
+        return
+    user_pks = set([instance.user_id])
+    group_pks = set([instance.group_id])
+    old_principals = getattr(instance, "_authority_old_principals", None)
+    if old_principals:
+        user_pks.add(old_principals[0])
+        group_pks.add(old_principals[1])
+    using = kwargs.get("using")
+    permission_cache.bump_versions("user", user_pks - set([None]), using)
+    permission_cache.bump_versions("group", group_pks - set([None]), using)
+
+
+def invalidate_changed_permissions(sender, user_pks=(), group_pks=(), **kwargs):
+    """
+    Invalidate the cached permissions of the users and groups whose
+    permissions were changed in bulk.
+    """
+    permission_cache = get_permission_cache()
+    if permission_cache is None:
+        return
+    using = router.db_for_write(sender)
+    permission_cache.bump_versions("user", set(user_pks) - set([None]), using)
+    permission_cache.bump_versions("group", set(group_pks) - set([None]), using)
+
+
+def invalidate_group_members(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate the cached permissions of users joining or leaving groups.
+    """
+    groups = getattr(get_user_model(), "groups", None)
+    if groups is None or sender is not groups.through:
+        return
+    if reverse and action == "pre_clear":
+        user_field = sender._meta.get_field(groups.field.m2m_field_name())
+        group_field = sender._meta.get_field(groups.field.m2m_reverse_field_name())
+        instance._authority_cleared_user_pks = list(
+            sender._default_manager.filter(
+                **{group_field.attname: instance.pk}
+            ).values_list(user_field.attname, flat=True)
+        )
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        # The user object itself might have been primed already.
+        instance._authority_perm_cache_filled = False
+        user_pks = [instance.pk]
+    elif action == "post_clear":
+        user_pks = getattr(instance, "_authority_cleared_user_pks", [])
+    else:
+        user_pks = pk_set
+    permission_cache = get_permission_cache()
+    if permission_cache is not None:
+        permission_cache.bump_versions("user", user_pks, kwargs.get("using"))
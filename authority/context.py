@@ -0,0 +1,56 @@
+from authority.permissions import BasePermission
+from authority.sites import site
+
+
+class PermissionContext(object):
+    """
+    The permission checks of a single request. All checks for the same user
+    share one permission instance per permission class and one primed cache,
+    even if they are given different objects of that user, e.g.
+    ``request.user`` and a user loaded from the database again.
+    """
+
+    def __init__(self, request=None):
+        self.request = request
+        self._users = None
+
+    def get_user(self, user):
+        """
+        Get the object of the given user the permissions are primed on, the
+        first one seen during the request (preferring ``request.user``).
+        """
+        if self._users is None:
+            self._users = {}
+            request_user = getattr(self.request, "user", None)
+            if request_user is not None and request_user.pk is not None:
+                self._users[request_user.pk] = request_user
+        if user is None or user.pk is None:
+            return user
+        return self._users.setdefault(user.pk, user)
+
+    def get_permission(self, user, perm_cls=BasePermission):
+        """
+        Get the instance of the permission class for the given user.
+        """
+        return site.get_permission_instance(self.get_user(user), perm_cls)
+
+    def get_check(self, user, label):
+        """
+        Get the bound check of a "permission_label.check_name" label for
+        the given user, or None if there's no such permission.
+        """
+        perm_cls, check_name = site.resolve_check(label)
+        if perm_cls is None:
+            return None
+        return getattr(self.get_permission(user, perm_cls), check_name, None)
+
+
+def get_permission_context(request):
+    """
+    Get the permission context of the request, creating it if the
+    ``PermissionContextMiddleware`` isn't used.
+    """
+    context = getattr(request, "permission_context", None)
+    if context is None:
+        context = request.permission_context = PermissionContext(request)
+    return context
@@ -8,7 +8,7 @@ from django.shortcuts import get_object_or_404
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
 
-from authority.utils import get_check
+from authority.context import get_permission_context
 from authority.views import permission_denied
 
 
@@ -17,58 +17,102 @@ try:
 except NameError:
     basestring = str
 
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError:
+    try:
+        from asyncio import iscoroutinefunction
+    except ImportError:
+        # Python 2
+        def iscoroutinefunction(func):
+            return False
+
+
+def get_lookup_params(lookup_variables, kwargs):
+    """
+    Get the arguments of a check from the keyword arguments of a view, looking
+    up the objects the lookup variables refer to.
+    """
+    params = []
+    for lookup_variable in lookup_variables:
+        if isinstance(lookup_variable, basestring):
+            value = kwargs.get(lookup_variable, None)
+            if value is None:
+                continue
+            params.append(value)
+        elif isinstance(lookup_variable, (tuple, list)):
+            model, lookup, varname = lookup_variable
+            value = kwargs.get(varname, None)
+            if value is None:
+                continue
+            if isinstance(model, basestring):
+                model_class = apps.get_model(*model.split("."))
+            else:
+                model_class = model
+            if model_class is None:
+                raise ValueError(
+                    "The given argument '%s' is not a valid model." % model
+                )
+            if inspect.isclass(model_class) and not issubclass(model_class, Model):
+                raise ValueError("The argument %s needs to be a model." % model)
+            obj = get_object_or_404(model_class, **{lookup: value})
+            params.append(obj)
+    return params
+
+
+def has_permission(request, perm, lookup_variables, kwargs):
+    """
+    Check whether the user of the request has the permission for the
+    objects the lookup variables refer to, or Django's permission.
+    """
+    if not request.user.is_authenticated:
+        return False
+    params = get_lookup_params(lookup_variables, kwargs)
+    check = get_permission_context(request).get_check(request.user, perm)
+    if check is not None and check(*params):
+        return True
+    return request.user.has_perm(perm)
+
+
+def deny(request, login_url, redirect_field_name, redirect_to_login):
+    """
+    Redirect to the log-in page or return a permission denied (403) page.
+    """
+    if redirect_to_login:
+        path = urlquote(request.get_full_path())
+        tup = login_url, redirect_field_name, path
+        return HttpResponseRedirect("%s?%s=%s" % tup)
+    return permission_denied(request)
+
 
 def permission_required(perm, *lookup_variables, **kwargs):
     """
     Decorator for views that checks whether a user has a particular permission
     enabled, redirecting to the log-in page if necessary.
+
+    Async views are checked with the async permission API.
     """
     login_url = kwargs.pop("login_url", settings.LOGIN_URL)
     redirect_field_name = kwargs.pop("redirect_field_name", REDIRECT_FIELD_NAME)
     redirect_to_login = kwargs.pop("redirect_to_login", True)
 
     def decorate(view_func):
+        if iscoroutinefunction(view_func):
+            from authority.asynchronous import async_permission_required
+
+            return async_permission_required(
+                view_func,
+                perm,
+                lookup_variables,
+                login_url,
+                redirect_field_name,
+                redirect_to_login,
+            )
+
         def decorated(request, *args, **kwargs):
-            if request.user.is_authenticated:
-                params = []
-                for lookup_variable in lookup_variables:
-                    if isinstance(lookup_variable, basestring):
-                        value = kwargs.get(lookup_variable, None)
-                        if value is None:
-                            continue
-                        params.append(value)
-                    elif isinstance(lookup_variable, (tuple, list)):
-                        model, lookup, varname = lookup_variable
-                        value = kwargs.get(varname, None)
-                        if value is None:
-                            continue
-                        if isinstance(model, basestring):
-                            model_class = apps.get_model(*model.split("."))
-                        else:
-                            model_class = model
-                        if model_class is None:
-                            raise ValueError(
-                                "The given argument '%s' is not a valid model." % model
-                            )
-                        if inspect.isclass(model_class) and not issubclass(
-                            model_class, Model
-                        ):
-                            raise ValueError(
-                                "The argument %s needs to be a model." % model
-                            )
-                        obj = get_object_or_404(model_class, **{lookup: value})
-                        params.append(obj)
-                check = get_check(request.user, perm)
-                granted = False
-                if check is not None:
-                    granted = check(*params)
-                if granted or request.user.has_perm(perm):
-                    return view_func(request, *args, **kwargs)
-            if redirect_to_login:
-                path = urlquote(request.get_full_path())
-                tup = login_url, redirect_field_name, path
-                return HttpResponseRedirect("%s?%s=%s" % tup)
-            return permission_denied(request)
+            if has_permission(request, perm, lookup_variables, kwargs):
+                return view_func(request, *args, **kwargs)
+            return deny(request, login_url, redirect_field_name, redirect_to_login)
 
         return wraps(view_func)(decorated)
 
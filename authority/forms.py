@@ -23,6 +23,7 @@ class BasePermissionForm(forms.ModelForm):
         self.perm = perm
         self.obj = obj
         self.approved = approved
+        self.permission_context = kwargs.pop("permission_context", None)
         if obj and perm:
             self.base_fields["codename"].widget = forms.HiddenInput()
         elif obj and (not perm or not approved):
@@ -38,6 +39,15 @@ class BasePermissionForm(forms.ModelForm):
         self.instance.approved = self.approved
         return super(BasePermissionForm, self).save(commit)
 
+    def get_user_permission(self, user):
+        """
+        Get a permission instance for the user, from the permission context
+        of the request if the form was given one.
+        """
+        if self.permission_context is not None:
+            return self.permission_context.get_permission(user)
+        return permissions.BasePermission(user=user)
+
 
 class UserPermissionForm(BasePermissionForm):
     user = forms.CharField(label=_("User"))
@@ -58,7 +68,7 @@ class UserPermissionForm(BasePermissionForm):
             raise forms.ValidationError(
                 mark_safe(_("A user with that username does not exist."))
             )
-        check = permissions.BasePermission(user=user)
+        check = self.get_user_permission(user)
         error_msg = None
         if user.is_superuser:
             error_msg = _(
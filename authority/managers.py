@@ -1,12 +1,90 @@
+from datetime import datetime
+
+import django
+from django.conf import settings
 from django.db import models
-from django.db.models import Q
+from django.db.models import BooleanField, Exists, OuterRef, Q, Value
+from django.db.models import prefetch_related_objects
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 
+from authority.signals import permissions_changed
+
+
+class PermissionQuerySet(models.QuerySet):
+    def delete_without_signals(self):
+        """
+        Delete the permissions with a single plain DELETE and return the
+        number of deleted rows. Unlike delete() it doesn't load the rows to
+        send pre_delete and post_delete signals for each of them.
+
+        Bypassing the deletion collector is safe since no model has a foreign
+        key to Permission, so there is nothing to cascade. The callers send a
+        single permissions_changed signal for the deleted permissions instead.
+        """
+        return self._raw_delete(self.db)
+
+    def with_content_objects(self):
+        """
+        Resolve the content objects of the permissions with one query per
+        content type once the queryset is evaluated, instead of one query
+        per permission.
+        """
+        return self.prefetch_related("content_object")
+
+    def approve(self, creator):
+        """
+        Approve the permission requests in the queryset with a single UPDATE,
+        like ``Permission.approve`` does for one. Returns the number of
+        approved permission requests.
+        """
+        requests = self.filter(approved=False)
+        principals = set(requests.values_list("user_id", "group_id").distinct())
+        if not principals:
+            return 0
+        approved = requests.update(
+            approved=True, creator=creator, date_approved=datetime.now()
+        )
+        permissions_changed.send(
+            sender=self.model,
+            user_pks=set(user_pk for user_pk, _ in principals) - set([None]),
+            group_pks=set(group_pk for _, group_pk in principals) - set([None]),
+        )
+        return approved
+
 
 class PermissionManager(models.Manager):
+    def get_queryset(self):
+        return PermissionQuerySet(self.model, using=self._db)
+
+    def approve(self, creator):
+        return self.get_queryset().approve(creator)
+
+    def with_content_objects(self):
+        return self.get_queryset().with_content_objects()
+
+    def resolve_content_objects(self, perms):
+        """
+        Resolve the content objects of a list of permissions with one query
+        per content type. Returns the permissions as a list.
+        """
+        perms = list(perms)
+        prefetch_related_objects(perms, "content_object")
+        return perms
+
     def get_content_type(self, obj):
         return ContentType.objects.get_for_model(obj)
 
+    def user_group_pks(self, user_pk):
+        """
+        Subquery of the pks of the user's groups, straight from the table
+        relating users and groups.
+        """
+        groups = get_user_model()._meta.get_field("groups")
+        return groups.remote_field.through._default_manager.filter(
+            **{groups.m2m_field_name(): user_pk}
+        ).values(groups.m2m_reverse_field_name())
+
     def get_for_model(self, obj):
         return self.filter(content_type=self.get_content_type(obj))
 
@@ -37,6 +115,120 @@ class PermissionManager(models.Manager):
             codename=perm, approved=approved,
         )
 
+    def get_cached_content_type(self, obj):
+        """
+        Get the content type of obj if it's in the cache of ContentType
+        already, or None, without querying the database.
+        """
+        try:
+            return ContentType.objects._get_from_cache(obj._meta.concrete_model._meta)
+        except KeyError:
+            return None
+
+    def user_object_permissions(
+        self, user, perm, obj, approved=True, check_groups=True
+    ):
+        """
+        Get the user's perm permissions on obj, filtered without any joins
+        """
+        perms = self.filter(
+            content_type=self.get_content_type(obj),
+            object_id=obj.pk,
+            codename=perm,
+            approved=approved,
+        )
+        query = Q(user__pk=user.pk)
+        if check_groups:
+            query |= Q(group__pk__in=self.user_group_pks(user.pk))
+        return perms.filter(query)
+
+    def group_object_permissions(self, group, perm, obj, approved=True):
+        """
+        Get the group's perm permissions on obj, filtered without any joins
+        """
+        return self.filter(
+            content_type=self.get_content_type(obj),
+            object_id=obj.pk,
+            codename=perm,
+            approved=approved,
+            group__pk=group.pk,
+        )
+
+    def user_permission_exists(
+        self, user, perm, obj, approved=True, check_groups=True
+    ):
+        """
+        Check in the database if the user has the perm permission on obj,
+        with a single EXISTS query without any joins
+        """
+        return self.user_object_permissions(
+            user, perm, obj, approved, check_groups
+        ).exists()
+
+    def group_permission_exists(self, group, perm, obj, approved=True):
+        """
+        Check in the database if the group has the perm permission on obj,
+        with a single EXISTS query without any joins
+        """
+        return self.group_object_permissions(group, perm, obj, approved).exists()
+
+    def object_permissions(self, user, perm, model, approved=True, check_groups=True):
+        """
+        Get a subquery of the user's permissions correlated to the ``pk`` of
+        the outer query on ``model``, to be used with ``Exists``
+        """
+        perms = self.get_for_model(model).filter(
+            object_id=OuterRef("pk"), codename=perm, approved=approved,
+        )
+        if not check_groups:
+            return perms.filter(user__pk=user.pk)
+        return perms.filter(Q(user__pk=user.pk) | Q(group__in=user.groups.all()))
+
+    def objects_with_perm(self, user, perm, queryset, approved=True, check_groups=True):
+        """
+        Filter a queryset of a registered model to the objects the user has
+        the perm permission on, in the database.
+        """
+        if user.is_superuser:
+            return queryset
+        if not user.is_active:
+            return queryset.none()
+        has_perm = Exists(
+            self.object_permissions(user, perm, queryset.model, approved, check_groups)
+        )
+        if django.VERSION < (3, 0):
+            # Filtering on an expression directly requires Django 3.0
+            return queryset.annotate(_authority_has_perm=has_perm).filter(
+                _authority_has_perm=True
+            )
+        return queryset.filter(has_perm)
+
+    def annotate_permissions(
+        self, user, perms, queryset, approved=True, check_groups=True
+    ):
+        """
+        Annotate a queryset of a registered model with one boolean column per
+        permission. perms is either a dict mapping column names to permission
+        codenames, or a list of codenames, in which case the columns are named
+        after the check, e.g. "can_change_poll" for
+        "poll_permission.change_poll".
+        """
+        if not isinstance(perms, dict):
+            perms = dict(("can_%s" % perm.split(".")[-1], perm) for perm in perms)
+        annotations = {}
+        for name, perm in perms.items():
+            if user.is_superuser or not user.is_active:
+                annotations[name] = Value(
+                    user.is_superuser, output_field=BooleanField()
+                )
+            else:
+                annotations[name] = Exists(
+                    self.object_permissions(
+                        user, perm, queryset.model, approved, check_groups
+                    )
+                )
+        return queryset.annotate(**annotations)
+
     def group_permissions(self, group, perm, obj, approved=True):
         """
         Get objects that have Group perm permission on
@@ -63,3 +255,90 @@ class PermissionManager(models.Manager):
             return
         perms = self.user_permissions(user, perm, obj).filter(object_id=obj.id)
         perms.delete()
+
+    def revoke(
+        self,
+        users=None,
+        groups=None,
+        objects=None,
+        codenames=None,
+        approved=None,
+        batch_size=None,
+    ):
+        """
+        Delete the permissions of any of the given users and groups (objects
+        or pks) on any of the given objects (a list or a queryset) with any
+        of the given codenames, without filtering on the arguments that are
+        None. The rows are deleted in chunks of batch_size (the
+        AUTHORITY_BULK_BATCH_SIZE setting by default). Returns the number of
+        deleted permissions.
+
+        At least one of users, groups, objects or codenames has to be given,
+        so that a call without arguments can't delete all permissions.
+        """
+        if users is None and groups is None and objects is None and codenames is None:
+            raise ValueError(
+                "Permission.objects.revoke() requires users, groups, objects "
+                "or codenames."
+            )
+        if batch_size is None:
+            batch_size = getattr(settings, "AUTHORITY_BULK_BATCH_SIZE", 1000)
+        perms = self.all()
+        if users is not None or groups is not None:
+            principals = Q()
+            if users is not None:
+                principals |= Q(user__pk__in=[getattr(u, "pk", u) for u in users])
+            if groups is not None:
+                principals |= Q(group__pk__in=[getattr(g, "pk", g) for g in groups])
+            perms = perms.filter(principals)
+        if codenames is not None:
+            perms = perms.filter(codename__in=list(codenames))
+        if approved is not None:
+            perms = perms.filter(approved=approved)
+
+        if objects is None:
+            chunks = [perms]
+        elif isinstance(objects, models.QuerySet):
+            # Filter by a subquery instead of loading all the objects.
+            chunks = [
+                perms.filter(
+                    content_type=self.get_content_type(objects.model),
+                    object_id__in=objects.values("pk"),
+                )
+            ]
+        else:
+            object_pks = {}
+            for obj in objects:
+                content_type = self.get_content_type(obj)
+                object_pks.setdefault(content_type, []).append(obj.pk)
+            chunks = [
+                perms.filter(
+                    content_type=content_type,
+                    object_id__in=pks[start : start + batch_size],
+                )
+                for content_type, pks in object_pks.items()
+                for start in range(0, len(pks), batch_size)
+            ]
+
+        deleted = 0
+        user_pks = set()
+        group_pks = set()
+        for chunk in chunks:
+            while True:
+                rows = list(chunk.values_list("pk", "user_id", "group_id")[:batch_size])
+                if not rows:
+                    break
+                deleted += self.filter(
+                    pk__in=[pk for pk, _, _ in rows]
+                ).delete_without_signals()
+                user_pks.update(user_pk for _, user_pk, _ in rows)
+                group_pks.update(group_pk for _, _, group_pk in rows)
+                if len(rows) < batch_size:
+                    break
+        if deleted:
+            permissions_changed.send(
+                sender=self.model,
+                user_pks=user_pks - set([None]),
+                group_pks=group_pks - set([None]),
+            )
+        return deleted
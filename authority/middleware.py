@@ -0,0 +1,40 @@
+from authority.context import PermissionContext
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:
+    try:
+        from asyncio import coroutines, iscoroutinefunction
+
+        def markcoroutinefunction(func):
+            func._is_coroutine = coroutines._is_coroutine
+            return func
+
+    except ImportError:
+        # Python 2
+        def iscoroutinefunction(func):
+            return False
+
+        markcoroutinefunction = None
+
+
+class PermissionContextMiddleware(object):
+    """
+    Adds a ``permission_context`` to every request, shared by the decorators,
+    template tags, forms and views checking permissions while handling it.
+
+    In an async middleware stack it returns the awaitable of the next
+    middleware, so it runs without a thread hop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.permission_context = PermissionContext(request)
+        return self.get_response(request)
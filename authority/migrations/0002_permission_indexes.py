@@ -0,0 +1,69 @@
+from django.db import migrations, models
+
+
+APPROVED_INDEX = "authority_perm_approved_idx"
+
+
+def create_approved_index(apps, schema_editor):
+    """
+    Create a partial index over the approved permissions on the backends
+    supporting it. It's created with SQL instead of an Index with a
+    condition, which needs Django 2.2, so that the schema is the same on
+    every Django version.
+    """
+    if schema_editor.connection.vendor not in ("postgresql", "sqlite"):
+        return
+    model = apps.get_model("authority", "Permission")
+    quote_name = schema_editor.quote_name
+    schema_editor.execute(
+        "CREATE INDEX %s ON %s (%s, %s, %s) WHERE %s = %s"
+        % (
+            quote_name(APPROVED_INDEX),
+            quote_name(model._meta.db_table),
+            quote_name("content_type_id"),
+            quote_name("object_id"),
+            quote_name("codename"),
+            quote_name("approved"),
+            schema_editor.quote_value(True),
+        )
+    )
+
+
+def drop_approved_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in ("postgresql", "sqlite"):
+        return
+    schema_editor.execute(
+        "DROP INDEX IF EXISTS %s" % schema_editor.quote_name(APPROVED_INDEX)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authority", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="permission",
+            index=models.Index(
+                fields=["user", "content_type", "codename", "approved", "object_id"],
+                name="authority_perm_user_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="permission",
+            index=models.Index(
+                fields=["group", "content_type", "codename", "approved", "object_id"],
+                name="authority_perm_group_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="permission",
+            index=models.Index(
+                fields=["content_type", "object_id", "approved"],
+                name="authority_perm_object_idx",
+            ),
+        ),
+        migrations.RunPython(create_approved_index, drop_approved_index),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+
+LIKE_INDEX = "authority_perm_codename_like_idx"
+
+
+def create_like_index(apps, schema_editor):
+    """
+    Unless the collation is "C", PostgreSQL only uses an index for LIKE
+    queries with the pattern operator class, which an Index only supports
+    since Django 2.2. It's created with SQL, like Django does for the
+    indexed fields, so that the schema is the same on every Django version.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    model = apps.get_model("authority", "Permission")
+    schema_editor.execute(
+        "CREATE INDEX %s ON %s (%s varchar_pattern_ops)"
+        % (
+            schema_editor.quote_name(LIKE_INDEX),
+            schema_editor.quote_name(model._meta.db_table),
+            schema_editor.quote_name("codename"),
+        )
+    )
+
+
+def drop_like_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "DROP INDEX IF EXISTS %s" % schema_editor.quote_name(LIKE_INDEX)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authority", "0002_permission_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="permission",
+            index=models.Index(fields=["codename"], name="authority_perm_codename_idx"),
+        ),
+        migrations.RunPython(create_like_index, drop_like_index),
+    ]
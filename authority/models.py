@@ -1,12 +1,21 @@
 from datetime import datetime
+
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.auth.models import Group
 from django.utils.translation import ugettext_lazy as _
 
+from authority.cache import (
+    invalidate_changed_permissions,
+    invalidate_group_members,
+    invalidate_permission,
+    remember_permission_principals,
+)
 from authority.managers import PermissionManager
+from authority.signals import permissions_changed
 
 USER_MODEL = getattr(settings, "AUTH_USER_MODEL", "auth.User")
 
@@ -60,6 +69,31 @@ class Permission(models.Model):
 
     class Meta:
         unique_together = ("codename", "object_id", "content_type", "user", "group")
+        # Composite indexes for the queries of the PermissionManager and the
+        # smart cache prime, see the 0002_permission_indexes migration.
+        indexes = [
+            models.Index(
+                fields=["user", "content_type", "codename", "approved", "object_id"],
+                name="authority_perm_user_idx",
+            ),
+            models.Index(
+                fields=["group", "content_type", "codename", "approved", "object_id"],
+                name="authority_perm_group_idx",
+            ),
+            models.Index(
+                fields=["content_type", "object_id", "approved"],
+                name="authority_perm_object_idx",
+            ),
+            # For the prefix search of the admin.
+            models.Index(fields=["codename"], name="authority_perm_codename_idx"),
+        ]
+        # The migrations also create these indexes with SQL on the backends
+        # supporting them, so that the schema is the same on every Django
+        # version:
+        # - authority_perm_approved_idx, a partial index on (content_type,
+        #   object_id, codename) of the approved permissions (0002)
+        # - authority_perm_codename_like_idx, on codename with the pattern
+        #   operator class PostgreSQL needs to use it for LIKE (0003)
         verbose_name = _("permission")
         verbose_name_plural = _("permissions")
         permissions = (
@@ -82,3 +116,10 @@ class Permission(models.Model):
         self.approved = True
         self.creator = creator
         self.save()
+
+
+pre_save.connect(remember_permission_principals, sender=Permission)
+post_save.connect(invalidate_permission, sender=Permission)
+post_delete.connect(invalidate_permission, sender=Permission)
+m2m_changed.connect(invalidate_group_members)
+permissions_changed.connect(invalidate_changed_permissions, sender=Permission)
@@ -1,12 +1,37 @@
+from collections import OrderedDict
+from datetime import datetime
+
+import django
 from django.conf import settings
 from django.contrib.auth.models import Permission as DjangoPermission
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.db.models import F, IntegerField, Q, Value
 from django.db.models.base import Model, ModelBase
 from django.template.defaultfilters import slugify
 
+from authority.cache import PermissionSet, get_permission_cache
 from authority.exceptions import NotAModel, UnsavedModelInstance
 from authority.models import Permission
+from authority.signals import permissions_changed
+
+if django.VERSION >= (3, 0):
+    from authority.asynchronous import AsyncPermissionMixin
+else:
+
+    class AsyncPermissionMixin(object):
+        """
+        The async API is only available on Django 3.0 or later.
+        """
+
+
+# How the permissions of a user or group are checked, see
+# ``BasePermission.check_strategy``.
+STRATEGY_FULL = "full"
+STRATEGY_CONTENT_TYPE = "content_type"
+STRATEGY_QUERY = "query"
+
+# Conflicting rows inserted concurrently are skipped, where supported.
+BULK_CREATE_KWARGS = {"ignore_conflicts": True} if django.VERSION >= (2, 2) else {}
 
 
 class PermissionMetaclass(type):
@@ -27,7 +52,7 @@ class PermissionMetaclass(type):
         return new_class
 
 
-class BasePermission(object):
+class BasePermission(AsyncPermissionMixin):
     """
     Base Permission class to be used to define app permissions.
     """
@@ -43,126 +68,429 @@ class BasePermission(object):
         self.group = group
         super(BasePermission, self).__init__(*args, **kwargs)
 
-    def _get_user_cached_perms(self):
+    def _load_cached_perms(
+        self,
+        user_pk=None,
+        group_pks=(),
+        content_type_pk=None,
+        approved=None,
+        limit=None,
+    ):
         """
-        Set up both the user and group caches.
+        Load the permissions of a user and of groups from the database in a
+        single query. Returns the permissions of the user and a dict with the
+        permissions of each group. If group_pks is None the permissions of
+        all the user's groups are loaded. If a content type is given only the
+        permissions of that content type and approval state are loaded. If
+        there are more than limit permissions None is returned instead.
         """
-        if not self.user:
-            return {}, {}
-        group_pks = set(self.user.groups.values_list("pk", flat=True,))
-        perms = Permission.objects.filter(
-            Q(user__pk=self.user.pk) | Q(group__pk__in=group_pks),
+        user_permissions = PermissionSet()
+        group_permissions = dict(
+            (group_pk, PermissionSet()) for group_pk in group_pks or ()
         )
-        user_permissions = {}
-        group_permissions = {}
-        for perm in perms:
-            if perm.user_id == self.user.pk:
-                user_permissions[
-                    (
-                        perm.object_id,
-                        perm.content_type_id,
-                        perm.codename,
-                        perm.approved,
-                    )
-                ] = True
-            # If the user has the permission do for something, but perm.user !=
-            # self.user then by definition that permission came from the
-            # group.
+        perms = Permission.objects.all()
+        if content_type_pk is not None:
+            perms = perms.filter(content_type__pk=content_type_pk, approved=approved)
+        # A UNION ALL of one index friendly query per source of permissions
+        # instead of an OR across the user and group columns. The source is
+        # NULL for the user's own permissions and the group pk otherwise.
+        branches = []
+        if user_pk is not None:
+            branches.append(
+                perms.filter(user__pk=user_pk).annotate(
+                    source=Value(None, output_field=IntegerField())
+                )
+            )
+        if group_pks is None and user_pk is not None:
+            group_pks = Permission.objects.user_group_pks(user_pk)
+        elif not group_pks:
+            group_pks = None
+        if group_pks is not None:
+            branches.append(
+                perms.filter(group__pk__in=group_pks).annotate(source=F("group"))
+            )
+        if not branches:
+            return user_permissions, group_permissions
+        # Only the columns needed, streamed in chunks without building model
+        # instances.
+        branches = [
+            branch.values_list(
+                "object_id", "content_type_id", "codename", "approved", "source"
+            )
+            for branch in branches
+        ]
+        rows = branches[0]
+        if len(branches) > 1:
+            rows = rows.union(*branches[1:], all=True)
+        if limit is not None:
+            rows = rows[: limit + 1]
+        if django.VERSION >= (2, 0):
+            chunk_size = getattr(settings, "AUTHORITY_PRIME_CHUNK_SIZE", 2000)
+            rows = rows.iterator(chunk_size=chunk_size)
+        else:
+            rows = rows.iterator()
+        count = 0
+        for object_id, content_type_id, codename, approved, source in rows:
+            count += 1
+            if limit is not None and count > limit:
+                return None
+            if source is None:
+                user_permissions.add(object_id, content_type_id, codename, approved)
             else:
-                group_permissions[
-                    (
-                        perm.object_id,
-                        perm.content_type_id,
-                        perm.codename,
-                        perm.approved,
-                    )
-                ] = True
-        return user_permissions, group_permissions
+                if source not in group_permissions:
+                    group_permissions[source] = PermissionSet()
+                group_permissions[source].add(
+                    object_id, content_type_id, codename, approved
+                )
+        for permission_set in group_permissions.values():
+            permission_set.freeze()
+        return user_permissions.freeze(), group_permissions
+
+    def _get_user_cached_perms(self, content_type_pk=None, approved=None):
+        """
+        Set up both the user and group caches. Returns the permissions of the
+        user and a list with the permissions of each of the user's groups.
+
+        With the shared cache the permissions of a group are cached once for
+        the group and are shared by all its members.
+        """
+        if not self.user:
+            return {}, []
+        shared_cache = get_permission_cache()
+        if shared_cache is None:
+            # The user's groups are looked up in the same query.
+            user_permissions, group_permissions = self._load_cached_perms(
+                self.user.pk, None, content_type_pk, approved
+            )
+            return user_permissions, list(group_permissions.values())
+
+        group_pks = sorted(self._user_group_pks)
+        user_key, group_keys = self._user_cache_keys(
+            shared_cache, content_type_pk, approved
+        )
+        user_permissions = shared_cache.get(user_key)
+        group_permissions = shared_cache.get_many(group_keys.values())
+        group_permissions = dict(
+            (group_pk, group_permissions[key])
+            for group_pk, key in group_keys.items()
+            if key in group_permissions
+        )
+
+        missing_group_pks = [pk for pk in group_pks if pk not in group_permissions]
+        if user_permissions is None or missing_group_pks:
+            loaded_user_permissions, loaded_group_permissions = self._load_cached_perms(
+                self.user.pk if user_permissions is None else None,
+                missing_group_pks,
+                content_type_pk,
+                approved,
+            )
+            if user_permissions is None:
+                user_permissions = loaded_user_permissions
+                shared_cache.set(user_key, user_permissions)
+            group_permissions.update(loaded_group_permissions)
+            shared_cache.set_many(
+                dict(
+                    (group_keys[group_pk], perms)
+                    for group_pk, perms in loaded_group_permissions.items()
+                )
+            )
+        return (
+            user_permissions,
+            [group_permissions[group_pk] for group_pk in group_pks],
+        )
 
-    def _get_group_cached_perms(self):
+    def _user_cache_keys(self, shared_cache, content_type_pk=None, approved=None):
+        """
+        The key of the permissions of the user and a dict with the keys of the
+        permissions of each of its groups in the shared cache.
         """
-        Set group cache.
+        user_version, group_versions = self._user_cache_versions
+        user_key = shared_cache.make_key(
+            "user_perms",
+            [("user", self.user.pk, user_version)],
+            content_type_pk,
+            approved,
+        )
+        group_keys = dict(
+            (
+                group_pk,
+                shared_cache.make_key(
+                    "group_perms",
+                    [("group", group_pk, group_versions[group_pk])],
+                    content_type_pk,
+                    approved,
+                ),
+            )
+            for group_pk in self._user_group_pks
+        )
+        return user_key, group_keys
+
+    def _get_group_cached_perms(self, content_type_pk=None, approved=None):
+        """
+        Set group cache. If a content type is given only the permissions of
+        that content type and approval state are loaded.
         """
         if not self.group:
             return {}
-        perms = Permission.objects.filter(group=self.group,)
-        group_permissions = {}
-        for perm in perms:
-            group_permissions[
-                (perm.object_id, perm.content_type_id, perm.codename, perm.approved,)
-            ] = True
-        return group_permissions
 
-    def _prime_user_perm_caches(self):
+        def _load_group_cached_perms():
+            return self._load_cached_perms(
+                None, [self.group.pk], content_type_pk, approved
+            )[1][self.group.pk]
+
+        shared_cache = get_permission_cache()
+        if shared_cache is None:
+            return _load_group_cached_perms()
+        key = shared_cache.make_key(
+            "group_perms", self._group_cache_versions, content_type_pk, approved
+        )
+        return shared_cache.get_or_set(key, _load_group_cached_perms)
+
+    @property
+    def _user_group_pks(self):
         """
-        Prime both the user and group caches and put them on the ``self.user``.
-        In addition add a cache filled flag on ``self.user``.
+        The primary keys of the user's groups, cached on ``self.user`` until
+        the permission cache is invalidated.
         """
-        perm_cache, group_perm_cache = self._get_user_cached_perms()
-        self.user._authority_perm_cache = perm_cache
-        self.user._authority_group_perm_cache = group_perm_cache
-        self.user._authority_perm_cache_filled = True
+        group_pks = getattr(self.user, "_authority_group_pks", None)
+        if group_pks is None:
 
-    def _prime_group_perm_caches(self):
+            def _load_group_pks():
+                return set(self.user.groups.values_list("pk", flat=True,))
+
+            shared_cache = get_permission_cache()
+            if shared_cache is None:
+                group_pks = _load_group_pks()
+            else:
+                versions = shared_cache.get_versions("user", [self.user.pk])
+                key = shared_cache.make_key(
+                    "user_groups", [("user", self.user.pk, versions[self.user.pk])]
+                )
+                group_pks = shared_cache.get_or_set(key, _load_group_pks)
+            self.user._authority_group_pks = group_pks
+        return group_pks
+
+    @property
+    def _user_cache_versions(self):
         """
-        Prime the group cache and put them on the ``self.group``.
-        In addition add a cache filled flag on ``self.group``.
+        The version of the user and a dict of the versions of its groups in
+        the shared cache, read once and kept on ``self.user`` until the
+        permission cache is invalidated.
         """
-        perm_cache = self._get_group_cached_perms()
-        self.group._authority_perm_cache = perm_cache
-        self.group._authority_perm_cache_filled = True
+        versions = getattr(self.user, "_authority_cache_versions", None)
+        if versions is None:
+            shared_cache = get_permission_cache()
+            user_versions = shared_cache.get_versions("user", [self.user.pk])
+            versions = (
+                user_versions[self.user.pk],
+                shared_cache.get_versions("group", self._user_group_pks),
+            )
+            self.user._authority_cache_versions = versions
+        return versions
 
     @property
-    def _user_perm_cache(self):
+    def _group_cache_versions(self):
         """
-        cached_permissions will generate the cache in a lazy fashion.
+        The version of the group in the shared cache, read once and kept on
+        ``self.group`` until the permission cache is invalidated.
         """
-        # Check to see if the cache has been primed.
-        if not self.user:
-            return {}
-        cache_filled = getattr(self.user, "_authority_perm_cache_filled", False,)
-        if cache_filled:
-            # Don't really like the name for this, but this matches how Django
-            # does it.
-            return self.user._authority_perm_cache
+        versions = getattr(self.group, "_authority_cache_versions", None)
+        if versions is None:
+            group_versions = get_permission_cache().get_versions(
+                "group", [self.group.pk]
+            )
+            versions = [("group", self.group.pk, group_versions[self.group.pk])]
+            self.group._authority_cache_versions = versions
+        return versions
 
-        # Prime the cache.
-        self._prime_user_perm_caches()
-        return self.user._authority_perm_cache
+    def _get_primed_slice(self, principal, content_type_pk=None, approved=None):
+        """
+        Get the cached permissions on the given user or group, if all its
+        permissions or the slice of the given content type and approval
+        state have been primed.
+        """
+        if not getattr(principal, "_authority_perm_cache_filled", False):
+            return None
+        slices = getattr(principal, "_authority_perm_cache_slices", {})
+        if (None, None) in slices:
+            return slices[(None, None)]
+        return slices.get((content_type_pk, approved))
 
-    @property
-    def _group_perm_cache(self):
+    def _reset_perm_caches(self, principal):
         """
-        cached_permissions will generate the cache in a lazy fashion.
+        Reset the caches on the given user or group if they are not filled.
         """
-        # Check to see if the cache has been primed.
-        if not self.group:
-            return {}
-        cache_filled = getattr(self.group, "_authority_perm_cache_filled", False,)
-        if cache_filled:
-            # Don't really like the name for this, but this matches how Django
-            # does it.
-            return self.group._authority_perm_cache
+        if not getattr(principal, "_authority_perm_cache_filled", False):
+            principal._authority_perm_cache_slices = {}
+            principal._authority_group_pks = None
+            principal._authority_cache_versions = None
+            principal._authority_check_strategy = None
+            principal._authority_perm_cache_filled = True
 
-        # Prime the cache.
-        self._prime_group_perm_caches()
-        return self.group._authority_perm_cache
+    def _estimate_check_strategy(self, principal):
+        """
+        Choose the strategy for the given user or group from the number of
+        its permissions. Returns the strategy and, if all the permissions had
+        to be loaded to count them, the loaded permissions.
+        """
+        full_threshold = getattr(settings, "AUTHORITY_FULL_PRIME_THRESHOLD", 1000)
+        prime_threshold = getattr(settings, "AUTHORITY_PRIME_THRESHOLD", 100000)
+        # Small principals are the common case, so try to prime everything
+        # right away and only count if that turns out to be too much.
+        if principal is self.user:
+            loaded = self._load_cached_perms(self.user.pk, None, limit=full_threshold)
+            if loaded is not None:
+                return STRATEGY_FULL, loaded
+            perms = Permission.objects.filter(
+                Q(user__pk=self.user.pk)
+                | Q(group__pk__in=Permission.objects.user_group_pks(self.user.pk))
+            )
+        else:
+            loaded = self._load_cached_perms(
+                None, [self.group.pk], limit=full_threshold
+            )
+            if loaded is not None:
+                return STRATEGY_FULL, loaded[1][self.group.pk]
+            perms = Permission.objects.filter(group__pk=self.group.pk)
+        # Counting stops at the threshold, principals above it are not primed.
+        if perms[: prime_threshold + 1].count() > prime_threshold:
+            return STRATEGY_QUERY, None
+        return STRATEGY_CONTENT_TYPE, None
+
+    def _get_check_strategy(self, principal):
+        """
+        Get the strategy for the given user or group, chosen once and kept on
+        it (and in the shared cache) until the permission cache is
+        invalidated.
+        """
+        if getattr(principal, "_authority_perm_cache_filled", False):
+            strategy = getattr(principal, "_authority_check_strategy", None)
+            if strategy is not None:
+                return strategy
+        self._reset_perm_caches(principal)
+        strategy = loaded = key = None
+        shared_cache = get_permission_cache()
+        if shared_cache is not None:
+            if principal is self.user:
+                versions = [("user", self.user.pk, self._user_cache_versions[0])]
+            else:
+                versions = self._group_cache_versions
+            key = shared_cache.make_key("strategy", versions)
+            strategy = shared_cache.get(key)
+        if strategy is None:
+            strategy, loaded = self._estimate_check_strategy(principal)
+            if shared_cache is not None:
+                shared_cache.set(key, strategy)
+        if loaded is not None:
+            self._keep_primed_perms(principal, loaded, shared_cache)
+        principal._authority_check_strategy = strategy
+        return strategy
+
+    def _keep_primed_perms(self, principal, loaded, shared_cache):
+        """
+        Keep all the permissions of the given user or group, loaded while
+        choosing the strategy, on it and in the shared cache.
+        """
+        if principal is self.user:
+            user_permissions, group_permissions = loaded
+            if shared_cache is not None:
+                user_key, group_keys = self._user_cache_keys(shared_cache)
+                # Groups without permissions are not part of the loaded ones.
+                group_permissions = dict(
+                    (group_pk, group_permissions.get(group_pk, PermissionSet()))
+                    for group_pk in group_keys
+                )
+                data = dict(
+                    (group_keys[group_pk], perms)
+                    for group_pk, perms in group_permissions.items()
+                )
+                data[user_key] = user_permissions
+                shared_cache.set_many(data)
+            loaded = (user_permissions, list(group_permissions.values()))
+        elif shared_cache is not None:
+            shared_cache.set(
+                shared_cache.make_key(
+                    "group_perms", self._group_cache_versions, None, None
+                ),
+                loaded,
+            )
+        principal._authority_perm_cache_slices[(None, None)] = loaded
 
     @property
-    def _user_group_perm_cache(self):
+    def check_strategy(self):
         """
-        cached_permissions will generate the cache in a lazy fashion.
+        How the permissions of the user (or group) are checked:
+
+        * ``"full"``: all of them are primed at once
+        * ``"content_type"``: primed per content type and approval state
+        * ``"query"``: the database is queried for every check
+        """
+        if not self.use_smart_cache:
+            return STRATEGY_QUERY
+        return self._get_check_strategy(self.user or self.group)
+
+    def _prime_user_perm_caches(self, content_type_pk=None, approved=None):
+        """
+        Prime both the user and group caches and put them on the ``self.user``.
+        In addition add a cache filled flag on ``self.user``. Only the slice
+        of the given content type and approval state is primed, or all
+        permissions if no content type is given.
+        """
+        self._reset_perm_caches(self.user)
+        perm_caches = self._get_user_cached_perms(content_type_pk, approved)
+        self.user._authority_perm_cache_slices[
+            (content_type_pk, approved)
+        ] = perm_caches
+        return perm_caches
+
+    def _prime_group_perm_caches(self, content_type_pk=None, approved=None):
+        """
+        Prime the group cache and put them on the ``self.group``.
+        In addition add a cache filled flag on ``self.group``. Only the slice
+        of the given content type and approval state is primed, or all
+        permissions if no content type is given.
+        """
+        self._reset_perm_caches(self.group)
+        perm_cache = self._get_group_cached_perms(content_type_pk, approved)
+        self.group._authority_perm_cache_slices[
+            (content_type_pk, approved)
+        ] = perm_cache
+        return perm_cache
+
+    def _get_user_perm_caches_for(self, content_type_pk, approved):
+        """
+        Get the cached permissions of the user and a list with the cached
+        permissions of each of its groups, priming only the slice of the
+        given content type and approval state in a lazy fashion.
         """
-        # Check to see if the cache has been primed.
         if not self.user:
-            return {}
-        cache_filled = getattr(self.user, "_authority_perm_cache_filled", False,)
-        if cache_filled:
-            return self.user._authority_group_perm_cache
+            return {}, []
+        perm_caches = self._get_primed_slice(self.user, content_type_pk, approved)
+        if perm_caches is None:
+            if self._get_check_strategy(self.user) == STRATEGY_FULL:
+                perm_caches = self._get_primed_slice(self.user)
+                if perm_caches is None:
+                    perm_caches = self._prime_user_perm_caches()
+            else:
+                perm_caches = self._prime_user_perm_caches(content_type_pk, approved)
+        return perm_caches
 
-        # Prime the cache.
-        self._prime_user_perm_caches()
-        return self.user._authority_group_perm_cache
+    def _get_group_perm_cache_for(self, content_type_pk, approved):
+        """
+        Get the group cache, priming only the slice of the given content type
+        and approval state in a lazy fashion.
+        """
+        if not self.group:
+            return {}
+        perm_cache = self._get_primed_slice(self.group, content_type_pk, approved)
+        if perm_cache is None:
+            if self._get_check_strategy(self.group) == STRATEGY_FULL:
+                perm_cache = self._get_primed_slice(self.group)
+                if perm_cache is None:
+                    perm_cache = self._prime_group_perm_caches()
+            else:
+                perm_cache = self._prime_group_perm_caches(content_type_pk, approved)
+        return perm_cache
 
     def invalidate_permissions_cache(self):
         """
@@ -171,11 +499,19 @@ class BasePermission(object):
         regenerated. By calling this method the invalidation will occur, and
         the next time the cached_permissions is used the cache will be
         re-primed.
+
+        If the shared cache is enabled the permissions cached there for the
+        user and group are invalidated as well.
         """
+        shared_cache = get_permission_cache()
         if self.user:
             self.user._authority_perm_cache_filled = False
+            if shared_cache is not None:
+                shared_cache.bump_versions("user", [self.user.pk])
         if self.group:
             self.group._authority_perm_cache_filled = False
+            if shared_cache is not None:
+                shared_cache.bump_versions("group", [self.group.pk])
 
     @property
     def use_smart_cache(self):
@@ -190,29 +526,34 @@ class BasePermission(object):
         if not self.user.is_active:
             return False
 
-        if self.use_smart_cache:
+        if (
+            self.use_smart_cache
+            and self._get_check_strategy(self.user) != STRATEGY_QUERY
+        ):
             content_type_pk = Permission.objects.get_content_type(obj).pk
+            perm_cache, group_perm_caches = self._get_user_perm_caches_for(
+                content_type_pk, approved
+            )
 
             def _user_has_perms(cached_perms):
                 # Check to see if the permission is in the cache.
                 return cached_perms.get((obj.pk, content_type_pk, perm, approved,))
 
             # Check to see if the permission is in the cache.
-            if _user_has_perms(self._user_perm_cache):
+            if _user_has_perms(perm_cache):
                 return True
 
             # Optionally check group permissions
             if check_groups:
-                return _user_has_perms(self._user_group_perm_cache)
+                return any(
+                    _user_has_perms(group_perm_cache)
+                    for group_perm_cache in group_perm_caches
+                )
             return False
 
         # Actually hit the DB, no smart cache used.
-        return (
-            Permission.objects.user_permissions(
-                self.user, perm, obj, approved, check_groups,
-            )
-            .filter(object_id=obj.pk,)
-            .exists()
+        return Permission.objects.user_permission_exists(
+            self.user, perm, obj, approved, check_groups,
         )
 
     def has_group_perms(self, perm, obj, approved):
@@ -222,7 +563,10 @@ class BasePermission(object):
         if not self.group:
             return False
 
-        if self.use_smart_cache:
+        if (
+            self.use_smart_cache
+            and self._get_check_strategy(self.group) != STRATEGY_QUERY
+        ):
             content_type_pk = Permission.objects.get_content_type(obj).pk
 
             def _group_has_perms(cached_perms):
@@ -230,13 +574,13 @@ class BasePermission(object):
                 return cached_perms.get((obj.pk, content_type_pk, perm, approved,))
 
             # Check to see if the permission is in the cache.
-            return _group_has_perms(self._group_perm_cache)
+            return _group_has_perms(
+                self._get_group_perm_cache_for(content_type_pk, approved)
+            )
 
         # Actually hit the DB, no smart cache used.
-        return (
-            Permission.objects.group_permissions(self.group, perm, obj, approved,)
-            .filter(object_id=obj.pk,)
-            .exists()
+        return Permission.objects.group_permission_exists(
+            self.group, perm, obj, approved,
         )
 
     def has_perm(self, perm, obj, check_groups=True, approved=True):
@@ -250,31 +594,207 @@ class BasePermission(object):
             return self.has_group_perms(perm, obj, approved)
         return False
 
+    def has_perm_for_objects(self, perm, objs, check_groups=True, approved=True):
+        """
+        Check if user or group has the permission for each of the given
+        objects. Returns a list of booleans in the same order as ``objs``.
+
+        The answer for the whole batch comes from a single cache priming (or
+        a single query if the smart cache is disabled).
+        """
+        objs = list(objs)
+        if not objs:
+            return []
+        if self.user and self.user.is_superuser:
+            return [True] * len(objs)
+
+        content_type_pks = {}
+        for obj in objs:
+            if obj.__class__ not in content_type_pks:
+                content_type_pks[obj.__class__] = Permission.objects.get_content_type(
+                    obj
+                ).pk
+        keys = [(obj.pk, content_type_pks[obj.__class__]) for obj in objs]
+
+        check_user = bool(self.user and self.user.is_active)
+        principals = ([self.user] if check_user else []) + (
+            [self.group] if self.group else []
+        )
+        if self.use_smart_cache and all(
+            self._get_check_strategy(principal) != STRATEGY_QUERY
+            for principal in principals
+        ):
+            caches = []
+            for content_type_pk in set(content_type_pks.values()):
+                if check_user:
+                    perm_cache, group_perm_caches = self._get_user_perm_caches_for(
+                        content_type_pk, approved
+                    )
+                    caches.append(perm_cache)
+                    if check_groups:
+                        caches.extend(group_perm_caches)
+                if self.group:
+                    caches.append(
+                        self._get_group_perm_cache_for(content_type_pk, approved)
+                    )
+            return [
+                any(
+                    cached_perms.get((object_pk, content_type_pk, perm, approved))
+                    for cached_perms in caches
+                )
+                for object_pk, content_type_pk in keys
+            ]
+
+        # Actually hit the DB once for the whole batch, no smart cache used.
+        perms = self._get_batch_permissions(
+            perm, keys, check_user, check_groups, approved
+        )
+        if perms is None:
+            return [False] * len(objs)
+        granted = set(perms)
+        return [key in granted for key in keys]
+
+    def _get_batch_permissions(self, perm, keys, check_user, check_groups, approved):
+        """
+        Get the (object_id, content_type_id) pairs of the given keys the user
+        or group has the perm permission on, or None if there's nobody to
+        check.
+        """
+        query = Q()
+        if check_user:
+            query |= Q(user__pk=self.user.pk)
+            if check_groups:
+                group_pks = Permission.objects.user_group_pks(self.user.pk)
+                query |= Q(group__pk__in=group_pks)
+        if self.group:
+            query |= Q(group=self.group)
+        if not query:
+            return None
+        return Permission.objects.filter(
+            query,
+            codename=perm,
+            approved=approved,
+            content_type__pk__in=set(content_type_pk for _, content_type_pk in keys),
+            object_id__in=set(object_pk for object_pk, _ in keys),
+        ).values_list("object_id", "content_type_id")
+
+    def _get_primed_perm(self, perm, obj, check_groups=True, approved=True):
+        """
+        Answer ``has_perm`` from the primed caches only. Returns None if that
+        would require querying the database.
+        """
+        if self.user and self.user.is_superuser:
+            return True
+        if not self.use_smart_cache:
+            return None
+        content_type = Permission.objects.get_cached_content_type(obj)
+        if content_type is None:
+            return None
+        key = (obj.pk, content_type.pk, perm, approved)
+        if self.user and self.user.is_active:
+            perm_caches = self._get_primed_slice(self.user, content_type.pk, approved)
+            if perm_caches is None:
+                return None
+            perm_cache, group_perm_caches = perm_caches
+            if perm_cache.get(key):
+                return True
+            if check_groups and any(
+                group_perm_cache.get(key) for group_perm_cache in group_perm_caches
+            ):
+                return True
+        if self.group:
+            perm_cache = self._get_primed_slice(self.group, content_type.pk, approved)
+            if perm_cache is None:
+                return None
+            return bool(perm_cache.get(key))
+        return False
+
     def requested_perm(self, perm, obj, check_groups=True):
         """
         Check if user requested a permission for the given object
         """
         return self.has_perm(perm, obj, check_groups, False)
 
+    def compile_check(self, check, model, generic=False):
+        """
+        Compute the authority and the Django codename of a check for a model.
+        """
+        return (
+            self.get_codename(check, model, generic),
+            self.get_django_codename(check, model, generic),
+        )
+
+    def get_compiled_check(self, check, model, generic=False):
+        """
+        Get the codenames of a check for a model from the table compiled when
+        the permission class was registered, compiling missing ones.
+        """
+        # Subclasses of registered classes have a label of their own.
+        compiled_checks = self.__class__.__dict__.get("compiled_checks")
+        if compiled_checks is None:
+            return self.compile_check(check, model, generic)
+        key = (check, model, generic)
+        codenames = compiled_checks.get(key)
+        if codenames is None:
+            codenames = compiled_checks[key] = self.compile_check(
+                check, model, generic
+            )
+        return codenames
+
     def can(self, check, generic=False, *args, **kwargs):
         if not args:
             args = [self.model]
         perms = False
         for obj in args:
-            # skip this obj if it's not a model class or instance
-            if not isinstance(obj, (ModelBase, Model)):
+            if isinstance(obj, Model):
+                model = obj.__class__
+            elif isinstance(obj, ModelBase):
+                model = obj
+            else:
+                # skip this obj if it's not a model class or instance
                 continue
+            codename, django_codename = self.get_compiled_check(check, model, generic)
             # first check Django's permission system
             if self.user:
-                perm = self.get_django_codename(check, obj, generic)
-                perms = perms or self.user.has_perm(perm)
-            perm = self.get_codename(check, obj, generic)
+                perms = perms or self.user.has_perm(django_codename)
             # then check authority's per object permissions
-            if not isinstance(obj, ModelBase) and isinstance(obj, self.model):
+            if model is not obj and isinstance(obj, self.model):
                 # only check the authority if obj is not a model class
-                perms = perms or self.has_perm(perm, obj)
+                perms = perms or self.has_perm(codename, obj)
         return perms
 
+    def can_for_objects(self, check, objs, generic=False):
+        """
+        Batch counterpart of ``can`` for a list of model instances, returns a
+        list of booleans in the same order as ``objs``.
+
+        Custom check methods are not called, only Django's permission system
+        and authority's per object permissions are consulted.
+        """
+        objs = list(objs)
+        results = [False] * len(objs)
+        indexes_by_model = {}
+        for index, obj in enumerate(objs):
+            # skip this obj if it's not a model instance
+            if isinstance(obj, Model):
+                indexes_by_model.setdefault(obj.__class__, []).append(index)
+        for model, indexes in indexes_by_model.items():
+            # first check Django's permission system, once per model
+            codename, django_codename = self.get_compiled_check(check, model, generic)
+            if self.user:
+                if self.user.has_perm(django_codename):
+                    for index in indexes:
+                        results[index] = True
+                    continue
+            # then check authority's per object permissions
+            if issubclass(model, self.model):
+                granted = self.has_perm_for_objects(
+                    codename, [objs[index] for index in indexes]
+                )
+                for index, is_granted in zip(indexes, granted):
+                    results[index] = is_granted
+        return results
+
     def get_django_codename(
         self, check, model_or_instance, generic=False, without_left=False
     ):
@@ -370,3 +890,179 @@ class BasePermission(object):
                     result.append(perm)
 
         return result
+
+    def bulk_assign(
+        self, check=None, content_object=None, generic=False, batch_size=None
+    ):
+        """
+        Assign permissions to a user or group like ``assign``, in bulk.
+
+        The existing permissions are looked up and the missing ones inserted
+        in batches of batch_size objects (the AUTHORITY_BULK_BATCH_SIZE
+        setting by default), instead of one query per object and check.
+        content_object can be a list or queryset of objects and model
+        classes. Returns the number of permissions that were assigned.
+        """
+        if batch_size is None:
+            batch_size = getattr(settings, "AUTHORITY_BULK_BATCH_SIZE", 1000)
+
+        if content_object is None:
+            content_objects = (self.model,)
+        elif isinstance(content_object, (Model, ModelBase)):
+            content_objects = (content_object,)
+        else:
+            content_objects = content_object
+
+        if not check:
+            checks = self.generic_checks + getattr(self, "checks", [])
+        elif not isinstance(check, (list, tuple)):
+            checks = (check,)
+        else:
+            checks = check
+
+        objects_by_model = {}
+        models = []
+        # raise an exception before adding any permission
+        for content_object in content_objects:
+            if isinstance(content_object, Model):
+                if not content_object.pk:
+                    raise UnsavedModelInstance(content_object)
+                objects_by_model.setdefault(content_object.__class__, []).append(
+                    content_object.pk
+                )
+            elif isinstance(content_object, ModelBase):
+                models.append(content_object)
+            else:
+                raise NotAModel(content_object)
+
+        assigned = 0
+        for model, object_pks in objects_by_model.items():
+            assigned += self._bulk_assign_objects(
+                checks, model, object_pks, generic, batch_size
+            )
+        if models:
+            assigned += self._bulk_assign_models(checks, models, generic, batch_size)
+        if assigned:
+            self._send_permissions_changed()
+        return assigned
+
+    def _bulk_assign_objects(self, checks, model, object_pks, generic, batch_size):
+        """
+        Assign authority per object permissions on the objects of a model.
+        """
+        content_type = ContentType.objects.get_for_model(model)
+        codenames = [self.get_codename(check, model, generic) for check in checks]
+        object_pks = list(OrderedDict.fromkeys(object_pks))
+        now = datetime.now()
+        assigned = 0
+        for start in range(0, len(object_pks), batch_size):
+            chunk = object_pks[start : start + batch_size]
+            existing = set(
+                Permission.objects.filter(
+                    user=self.user,
+                    group=self.group,
+                    content_type=content_type,
+                    codename__in=codenames,
+                    approved=True,
+                    object_id__in=chunk,
+                ).values_list("object_id", "codename")
+            )
+            perms = [
+                Permission(
+                    user=self.user,
+                    group=self.group,
+                    content_type=content_type,
+                    object_id=object_pk,
+                    codename=codename,
+                    approved=True,
+                    date_approved=now,
+                )
+                for object_pk in chunk
+                for codename in codenames
+                if (object_pk, codename) not in existing
+            ]
+            Permission.objects.bulk_create(perms, **BULK_CREATE_KWARGS)
+            assigned += len(perms)
+        return assigned
+
+    def _bulk_assign_models(self, checks, models, generic, batch_size):
+        """
+        Assign Django permissions on model classes, creating the missing
+        ones.
+        """
+        names = OrderedDict()
+        for model in models:
+            content_type = ContentType.objects.get_for_model(model)
+            for check in checks:
+                codename = self.get_django_codename(
+                    check, model, generic, without_left=True
+                )
+                name = check
+                if "_" in name:
+                    name = name[0 : name.find("_")]
+                names.setdefault((content_type.pk, codename), name)
+
+        def get_existing():
+            query = Q()
+            for content_type_pk, codename in names:
+                query |= Q(content_type__pk=content_type_pk, codename=codename)
+            return dict(
+                ((content_type_pk, codename), pk)
+                for pk, content_type_pk, codename in DjangoPermission.objects.filter(
+                    query
+                ).values_list("pk", "content_type_id", "codename")
+            )
+
+        existing = get_existing()
+        missing = [
+            DjangoPermission(name=name, codename=codename, content_type_id=ct_pk)
+            for (ct_pk, codename), name in names.items()
+            if (ct_pk, codename) not in existing
+        ]
+        if missing:
+            DjangoPermission.objects.bulk_create(
+                missing, batch_size=batch_size, **BULK_CREATE_KWARGS
+            )
+            existing = get_existing()
+
+        # Go through the table relating the user or group and the Django
+        # permissions, since the permissions attribute of a registered Group
+        # model is replaced with the authority permissions of the group.
+        if self.user:
+            principal = self.user
+            field = self.user._meta.get_field("user_permissions")
+        else:
+            principal = self.group
+            field = self.group._meta.get_field("permissions")
+        through = field.remote_field.through
+        principal_field = through._meta.get_field(field.m2m_field_name()).attname
+        perm_field = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        perm_pks = set(existing.values())
+        perm_pks.difference_update(
+            through._default_manager.filter(
+                **{principal_field: principal.pk, perm_field + "__in": perm_pks}
+            ).values_list(perm_field, flat=True)
+        )
+        through._default_manager.bulk_create(
+            [
+                through(**{principal_field: principal.pk, perm_field: perm_pk})
+                for perm_pk in perm_pks
+            ],
+            batch_size=batch_size,
+        )
+        return len(perm_pks)
+
+    def _send_permissions_changed(self):
+        """
+        Reset the caches on the user and group and let the shared cache know
+        their permissions changed in bulk.
+        """
+        if self.user:
+            self.user._authority_perm_cache_filled = False
+        if self.group:
+            self.group._authority_perm_cache_filled = False
+        permissions_changed.send(
+            sender=Permission,
+            user_pks=[self.user.pk] if self.user else [],
+            group_pks=[self.group.pk] if self.group else [],
+        )
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent by the bulk operations on permissions instead of a post_save or
+# post_delete signal per row, with the pks of the users and groups whose
+# permissions changed as ``user_pks`` and ``group_pks``.
+permissions_changed = Signal()
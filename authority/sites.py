@@ -1,10 +1,14 @@
 from inspect import getmembers, ismethod
+
+import django
 from django.apps import apps
 from django.db import models
 from django.db.models.base import ModelBase
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ImproperlyConfigured
 
+from authority.managers import PermissionQuerySet
+from authority.models import Permission
 from authority.permissions import BasePermission
 
 
@@ -23,26 +27,77 @@ class PermissionSite(object):
 
     _registry = {}
     _choices = {}
+    # The permission classes by label and the resolved permission class and
+    # check name by "label.check_name", kept up to date by register() and
+    # unregister().
+    _labels = {}
+    _checks = {}
 
     def get_permission_by_label(self, label):
-        for perm_cls in self._registry.values():
-            if perm_cls.label == label:
-                return perm_cls
-        return None
+        return self._labels.get(label)
 
     def get_permissions_by_model(self, model):
         return [perm for perm in self._registry.values() if perm.model == model]
 
+    def get_permission_instance(self, user, perm_cls):
+        """
+        Get an instance of the permission class for the user, reusing the one
+        created before for the same user object, i.e. within a request.
+        """
+        if user is None:
+            return perm_cls(user)
+        instances = getattr(user, "_authority_permission_instances", None)
+        if instances is None:
+            instances = user._authority_permission_instances = {}
+        perm_instance = instances.get(perm_cls)
+        if perm_instance is None:
+            perm_instance = instances[perm_cls] = perm_cls(user)
+        return perm_instance
+
+    def resolve_check(self, label):
+        """
+        Get the permission class and the check name of a
+        "permission_label.check_name" label, the class is None if there's
+        no permission with that label.
+        """
+        try:
+            return self._checks[label]
+        except KeyError:
+            perm_label, check_name = label.split(".")
+            perm_cls = self.get_permission_by_label(perm_label)
+            self._checks[label] = perm_cls, check_name
+            return perm_cls, check_name
+
     def get_check(self, user, label):
-        perm_label, check_name = label.split(".")
-        perm_cls = self.get_permission_by_label(perm_label)
+        perm_cls, check_name = self.resolve_check(label)
         if perm_cls is None:
             return None
-        perm_instance = perm_cls(user)
+        perm_instance = self.get_permission_instance(user, perm_cls)
         return getattr(perm_instance, check_name, None)
 
     def get_labels(self):
-        return [perm.label for perm in self._registry.values()]
+        return list(self._labels)
+
+    def build_indexes(self):
+        """
+        Rebuild the label index from the registry and resolve the checks of
+        all registered permission classes up front.
+        """
+        self._labels.clear()
+        self._checks.clear()
+        for perm_cls in self._registry.values():
+            self._labels.setdefault(perm_cls.label, perm_cls)
+        for label, perm_cls in self._labels.items():
+            for check_name in perm_cls.checks:
+                self._checks["%s.%s" % (label, check_name)] = perm_cls, check_name
+
+    def preload_content_types(self):
+        """
+        Load the content types of all registered models in a single query
+        into the cache of ContentType.
+        """
+        ContentType = apps.get_model("contenttypes", "contenttype")
+        ContentType.objects.get_for_models(*self._registry)
 
     def get_choices_for(self, obj, default=models.BLANK_CHOICE_DASH):
         model_cls = obj
@@ -90,6 +145,8 @@ class PermissionSite(object):
             permission_class.model = model
             self.setup(model, permission_class)
             self._registry[model] = permission_class
+            self._labels.setdefault(permission_class.label, permission_class)
+        self._checks.clear()
 
     def unregister(self, model_or_iterable):
         if isinstance(model_or_iterable, ModelBase):
@@ -97,9 +154,20 @@ class PermissionSite(object):
         for model in model_or_iterable:
             if model not in self._registry:
                 raise NotRegistered("The model %s is not registered" % model.__name__)
-            del self._registry[model]
+            perm_cls = self._registry.pop(model)
+            if self._labels.get(perm_cls.label) is perm_cls:
+                del self._labels[perm_cls.label]
+                # Another model might still be registered with the label.
+                for other_cls in self._registry.values():
+                    if other_cls.label == perm_cls.label:
+                        self._labels[perm_cls.label] = other_cls
+                        break
+        self._checks.clear()
 
     def setup(self, model, permission):
+        permission.compiled_checks = {}
+        # Compiled with the codename methods, which subclasses may override.
+        compiler = permission()
         for check_name in permission.checks:
             check_func = getattr(permission, check_name, None)
             if check_func is not None:
@@ -112,6 +180,10 @@ class PermissionSite(object):
                     % {"object_name": model._meta.object_name, "check": check_name},
                 )
                 setattr(permission, check_name, func)
+                # Precompute the codenames the check dispatches through.
+                permission.compiled_checks[
+                    (check_name, model, False)
+                ] = compiler.compile_check(check_name, model)
             else:
                 permission.generic_checks.append(check_name)
         for check_name in permission.generic_checks:
@@ -123,6 +195,9 @@ class PermissionSite(object):
                 "check": check_name,
             }
             func.check_name = check_name
+            permission.compiled_checks[
+                (check_name, model, True)
+            ] = compiler.compile_check(check_name, model, generic=True)
             if func_name not in permission.checks:
                 permission.checks = list(permission.checks) + [func_name]
             setattr(permission, func_name, func)
@@ -135,10 +210,53 @@ class PermissionSite(object):
                 return check_func(self, *args, **kwargs)
             return granted
 
+        # Let the async API dispatch the check without calling it.
+        check.check_name = check_name
+        check.check_func = check_func
+        check.generic = generic
         return check
 
 
+class InstancePermissionQuerySet(PermissionQuerySet):
+    """
+    The permissions of a single model instance, as returned by
+    PermissionDescriptor. Like a related manager it has the hooks
+    prefetch_related needs to store the prefetched permissions.
+    """
+
+    instance_filter = None
+    prefetched = False
+
+    def all(self):
+        # Like the all() of a related manager, keep the prefetched
+        # permissions instead of querying them again.
+        if self.prefetched:
+            return self
+        return super(InstancePermissionQuerySet, self).all()
+
+    def get_queryset(self):
+        # Called by prefetch_related to get the queryset it fills.
+        self.prefetched = True
+        return self
+
+    def _apply_rel_filters(self, queryset):
+        queryset = queryset.filter(**self.instance_filter)
+        prefetched = InstancePermissionQuerySet(
+            queryset.model, queryset.query, queryset.db
+        )
+        prefetched.prefetched = True
+        return prefetched
+
+
 class PermissionDescriptor(object):
+    """
+    Gives access to the permissions of a model instance, which can be
+    prefetched for a list of instances with
+    ``prefetch_related("permissions")``.
+    """
+
+    cache_name = "permissions"
+
     def get_content_type(self, obj=None):
         ContentType = apps.get_model("contenttypes", "contenttype")
         if obj:
@@ -148,11 +266,40 @@ class PermissionDescriptor(object):
                 "Invalid arguments given to PermissionDescriptor.get_content_type"
             )
 
+    def is_cached(self, instance):
+        return self.cache_name in getattr(instance, "_prefetched_objects_cache", {})
+
+    def get_prefetch_queryset(self, instances, queryset=None):
+        if queryset is None:
+            queryset = Permission._default_manager.get_queryset()
+        queryset = queryset.filter(
+            content_type=self.get_content_type(instances[0]),
+            object_id__in=[instance.pk for instance in instances],
+        )
+        prefetch = (
+            queryset,
+            lambda perm: perm.object_id,
+            lambda instance: instance.pk,
+            False,
+            self.cache_name,
+        )
+        if django.VERSION >= (2, 0):
+            # Whether the cache name is a descriptor, added in Django 2.0.
+            prefetch += (False,)
+        return prefetch
+
     def __get__(self, instance, owner):
         if instance is None:
             return self
-        ct = self.get_content_type(instance)
-        return ct.row_permissions.all()
+        if self.is_cached(instance):
+            return instance._prefetched_objects_cache[self.cache_name]
+        instance_filter = {
+            "content_type": self.get_content_type(instance),
+            "object_id": instance.pk,
+        }
+        queryset = InstancePermissionQuerySet(Permission).filter(**instance_filter)
+        queryset.instance_filter = instance_filter
+        return queryset
 
 
 site = PermissionSite()
@@ -4,8 +4,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
 from django.contrib.auth.models import AnonymousUser
 
-from authority.utils import get_check
-from authority import permissions
+from authority.context import PermissionContext, get_permission_context
 from authority.models import Permission
 from authority.forms import UserPermissionForm
 
@@ -50,6 +49,16 @@ class ResolverNode(template.Node):
         else:
             return template.Variable(var).resolve(context)
 
+    def get_permission_context(self, context):
+        """
+        Get the permission context of the request being rendered, or a new
+        one if the template context has no request.
+        """
+        request = context.get("request")
+        if request is None:
+            return PermissionContext()
+        return get_permission_context(request)
+
     @classmethod
     def next_bit_for(cls, bits, key, if_none=None):
         try:
@@ -104,7 +113,7 @@ class PermissionComparisonNode(ResolverNode):
                         objs.append(self.resolve(obj, context))
             else:
                 objs = None
-            check = get_check(user, perm)
+            check = self.get_permission_context(context).get_check(user, perm)
             if check is not None:
                 if check(*objs):
                     # return True if check was successful
@@ -182,7 +191,11 @@ class PermissionFormNode(ResolverNode):
                     "next": request.build_absolute_uri(),
                     "approved": self.approved,
                     "form": UserPermissionForm(
-                        perm, obj, approved=self.approved, initial=dict(codename=perm)
+                        perm,
+                        obj,
+                        approved=self.approved,
+                        initial=dict(codename=perm),
+                        permission_context=get_permission_context(request),
                     ),
                 }
         else:
@@ -196,6 +209,7 @@ class PermissionFormNode(ResolverNode):
                         obj,
                         approved=self.approved,
                         initial=dict(codename=perm, user=request.user.username),
+                        permission_context=get_permission_context(request),
                     ),
                 }
         return template.loader.render_to_string(template_name, extra_context, request)
@@ -258,7 +272,9 @@ class PermissionsForObjectNode(ResolverNode):
         user = self.resolve(self.user, context)
         perms = []
         if not isinstance(user, AnonymousUser):
-            perms = Permission.objects.for_object(obj, self.approved)
+            perms = Permission.objects.for_object(
+                obj, self.approved
+            ).with_content_objects()
             if isinstance(user, User):
                 perms = perms.filter(user=user)
         context[var_name] = perms
@@ -337,12 +353,13 @@ class PermissionForObjectNode(ResolverNode):
         user = self.resolve(self.user, context)
         granted = False
         if not isinstance(user, AnonymousUser):
+            permission_context = self.get_permission_context(context)
             if self.approved:
-                check = get_check(user, perm)
+                check = permission_context.get_check(user, perm)
                 if check is not None:
                     granted = check(*objs)
             else:
-                check = permissions.BasePermission(user=user)
+                check = permission_context.get_permission(user)
                 for obj in objs:
                     granted = check.requested_perm(perm, obj)
                     if granted:
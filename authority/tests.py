@@ -1,14 +1,35 @@
+import pickle
+from unittest import skipUnless
+
+import django
+from django.apps import apps
 from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission as DjangoPermission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import MultipleObjectsReturned
-from django.db.models import Q
-from django.test import TestCase
+from django.db.models import Prefetch, Q
+from django.core.cache import caches
+from django.db import connection
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 
 import authority
 from authority import permissions
+from authority.admin import (
+    ActionPermissionInline,
+    EstimatedCountPaginator,
+    PermissionAdmin,
+    edit_permissions,
+    get_object_permissions,
+)
+from authority.apps import AuthorityConfig
+from authority.cache import PermissionSet, get_permission_cache
+from authority.decorators import permission_required
+from authority.context import PermissionContext, get_permission_context
+from authority.middleware import PermissionContextMiddleware
 from authority.models import Permission
 from authority.exceptions import NotAModel, UnsavedModelInstance
 
@@ -271,7 +292,7 @@ class PerformanceTest(SmartCachingTestCase):
         # Regardless of how many times has_user_perms is called, the number of
         # queries is the same.
         # Content type and permissions (2 queries)
-        with self.assertNumQueries(3):
+        with self.assertNumQueries(2):
             for _ in range(5):
                 # Need to assert it so the query actually gets executed.
                 assert not self.user_check.has_user_perms(
@@ -287,7 +308,7 @@ class PerformanceTest(SmartCachingTestCase):
         # Regardless of the number groups permissions, it should only take one
         # query to check both users and groups.
         # Content type and permissions (2 queries)
-        with self.assertNumQueries(3):
+        with self.assertNumQueries(2):
             self.user_check.has_user_perms(
                 "foo", self.user, approved=True, check_groups=True,
             )
@@ -298,7 +319,7 @@ class PerformanceTest(SmartCachingTestCase):
         # For each time invalidate_permissions_cache gets called, you
         # will need to do one query to get content type and one to get
         # the permissions.
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(4):
             for _ in range(5):
                 assert not self.user_check.has_user_perms(
                     "foo", self.user, True, False,
@@ -346,7 +367,7 @@ class PerformanceTest(SmartCachingTestCase):
         # gets created.
 
         # Check the number of queries.
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             assert self.user_check.has_user_perms("foo", self.user, True, True)
 
         # Create a second group.
@@ -365,7 +386,7 @@ class PerformanceTest(SmartCachingTestCase):
         self.user_check.invalidate_permissions_cache()
 
         # Make sure it is the same number of queries.
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             assert self.user_check.has_user_perms("foo", self.user, True, True)
 
 
@@ -451,3 +472,1485 @@ class AddPermissionTestCase(TestCase):
         )
         r = self.client.get(url)
         self.assertEqual(r.status_code, 403)
+
+
+class BatchPermissionTestCase(TestCase):
+    """
+    Tests for checking one permission against many objects at once.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.group = Group.objects.create(name="batch")
+        self.group.user_set.add(self.user)
+        self.others = [
+            User.objects.create(username="batch%d" % i, email="batch%d@example.com" % i)
+            for i in range(3)
+        ]
+        self.check = UserPermission(self.user)
+        UserPermission(self.user).assign(
+            check="delete_user", content_object=self.others[0]
+        )
+        UserPermission(group=self.group).assign(
+            check="delete_user", content_object=self.others[2]
+        )
+
+    def test_has_perm_for_objects(self):
+        # One query for the user and group permissions, the content type is
+        # cached.
+        with self.assertNumQueries(1):
+            result = self.check.has_perm_for_objects(
+                "user_permission.delete_user", self.others
+            )
+        self.assertEqual(result, [True, False, True])
+        self.assertEqual(
+            self.check.has_perm_for_objects(
+                "user_permission.delete_user", self.others, check_groups=False
+            ),
+            [True, False, False],
+        )
+
+    def test_has_perm_for_objects_without_smart_cache(self):
+        settings.AUTHORITY_USE_SMART_CACHE = False
+        try:
+            with self.assertNumQueries(1):
+                result = self.check.has_perm_for_objects(
+                    "user_permission.delete_user", self.others
+                )
+        finally:
+            settings.AUTHORITY_USE_SMART_CACHE = True
+        self.assertEqual(result, [True, False, True])
+
+    def test_group_has_perm_for_objects(self):
+        check = UserPermission(group=self.group)
+        self.assertEqual(
+            check.has_perm_for_objects("user_permission.delete_user", self.others),
+            [False, False, True],
+        )
+
+    def test_can_for_objects(self):
+        self.assertEqual(
+            self.check.can_for_objects("delete_user", self.others),
+            [self.check.delete_user(obj) for obj in self.others],
+        )
+        self.assertEqual(self.check.can_for_objects("delete_user", []), [])
+
+
+class ObjectsWithPermTestCase(TestCase):
+    """
+    Tests for filtering querysets to the objects a user has a permission on.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.group = Group.objects.create(name="filter")
+        self.group.user_set.add(self.user)
+        self.others = [
+            User.objects.create(username="obj%d" % i, email="obj%d@example.com" % i)
+            for i in range(3)
+        ]
+        UserPermission(self.user).assign(
+            check="delete_user", content_object=self.others[0]
+        )
+        UserPermission(group=self.group).assign(
+            check="delete_user", content_object=self.others[2]
+        )
+
+    def test_objects_with_perm(self):
+        queryset = Permission.objects.objects_with_perm(
+            self.user, "user_permission.delete_user", User.objects.order_by("pk")
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(list(queryset), [self.others[0], self.others[2]])
+
+    def test_objects_with_perm_without_groups(self):
+        queryset = Permission.objects.objects_with_perm(
+            self.user,
+            "user_permission.delete_user",
+            User.objects.all(),
+            check_groups=False,
+        )
+        self.assertEqual(list(queryset), [self.others[0]])
+
+    def test_objects_with_perm_superuser_and_inactive(self):
+        self.user.is_superuser = True
+        queryset = Permission.objects.objects_with_perm(
+            self.user, "user_permission.delete_user", User.objects.all()
+        )
+        self.assertEqual(queryset.count(), User.objects.count())
+        self.user.is_superuser = False
+        self.user.is_active = False
+        queryset = Permission.objects.objects_with_perm(
+            self.user, "user_permission.delete_user", User.objects.all()
+        )
+        self.assertFalse(queryset.exists())
+
+    def test_annotate_permissions(self):
+        queryset = Permission.objects.annotate_permissions(
+            self.user,
+            ["user_permission.delete_user", "user_permission.change_user"],
+            User.objects.filter(pk__in=[obj.pk for obj in self.others]).order_by("pk"),
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [(obj.can_delete_user, obj.can_change_user) for obj in queryset],
+                [(True, False), (False, False), (True, False)],
+            )
+
+    def test_annotate_permissions_with_names(self):
+        queryset = Permission.objects.annotate_permissions(
+            self.user,
+            {"deletable": "user_permission.delete_user"},
+            User.objects.filter(pk=self.others[2].pk),
+            check_groups=False,
+        )
+        self.assertFalse(queryset.get().deletable)
+        self.user.is_superuser = True
+        queryset = Permission.objects.annotate_permissions(
+            self.user,
+            {"deletable": "user_permission.delete_user"},
+            User.objects.filter(pk=self.others[2].pk),
+        )
+        self.assertTrue(queryset.get().deletable)
+
+
+@override_settings(AUTHORITY_FULL_PRIME_THRESHOLD=0)
+class LazyPrimingTestCase(SmartCachingTestCase):
+    """
+    Tests that the cache is primed per content type and approval state.
+    """
+
+    def setUp(self):
+        super(LazyPrimingTestCase, self).setUp()
+        UserPermission(self.user).assign(check="delete_user", content_object=self.user)
+        GroupPermission(self.user).assign(
+            check="delete_group", content_object=self.group
+        )
+
+    def test_prime_only_checked_content_type(self):
+        group_content_type = Permission.objects.get_content_type(Group)
+        self.assertTrue(
+            self.user_check.has_user_perms(
+                "user_permission.delete_user", self.user, True
+            )
+        )
+        user_content_type = Permission.objects.get_content_type(User)
+        self.assertEqual(
+            list(self.user._authority_perm_cache_slices),
+            [(user_content_type.pk, True)],
+        )
+
+        # Priming another slice neither reloads the groups nor the first slice.
+        self.assertNotEqual(user_content_type, group_content_type)
+        group_check = GroupPermission(self.user)
+        with self.assertNumQueries(1):
+            self.assertTrue(
+                group_check.has_user_perms(
+                    "group_permission.delete_group", self.group, True
+                )
+            )
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                self.user_check.has_user_perms(
+                    "user_permission.delete_user", self.user, True
+                )
+            )
+
+    def test_prime_per_approval_state(self):
+        self.assertTrue(
+            self.user_check.has_user_perms(
+                "user_permission.delete_user", self.user, True
+            )
+        )
+        with self.assertNumQueries(1):
+            self.assertFalse(
+                self.user_check.requested_perm("user_permission.delete_user", self.user)
+            )
+
+
+@override_settings(AUTHORITY_CACHE="authority")
+class SharedCacheTestCase(SmartCachingTestCase):
+    """
+    Tests that primed permissions are shared between user objects through the
+    shared cache.
+    """
+
+    def setUp(self):
+        super(SharedCacheTestCase, self).setUp()
+        caches["authority"].clear()
+        get_permission_cache().local.clear()
+        UserPermission(self.user).assign(check="delete_user", content_object=self.user)
+
+    def tearDown(self):
+        super(SharedCacheTestCase, self).tearDown()
+        caches["authority"].clear()
+        get_permission_cache().local.clear()
+
+    def _check(self, group=None):
+        # A fresh user object, like the one of another request.
+        if group is not None:
+            check = UserPermission(group=group)
+        else:
+            check = UserPermission(User.objects.get(pk=self.user.pk))
+        return check.has_perm("user_permission.delete_user", self.user)
+
+    def test_shared_between_user_objects(self):
+        self.assertTrue(self._check())
+        with self.assertNumQueries(1):
+            # Only loading the user object itself.
+            self.assertTrue(self._check())
+
+    def test_served_from_shared_tier(self):
+        self.assertTrue(self._check())
+        get_permission_cache().local.clear()
+        with self.assertNumQueries(1):
+            self.assertTrue(self._check())
+
+    def test_invalidate(self):
+        self.assertTrue(self._check())
+        # Updates don't send any signals.
+        Permission.objects.filter(user=self.user).update(approved=False)
+        self.assertTrue(self._check())
+        UserPermission(self.user).invalidate_permissions_cache()
+        self.assertFalse(self._check())
+
+    def test_group_perms(self):
+        self.assertFalse(self._check(self.group))
+        UserPermission(group=self.group).assign(
+            check="delete_user", content_object=self.user
+        )
+        self.assertFalse(self._check(self.group))
+        UserPermission(group=self.group).invalidate_permissions_cache()
+        self.assertTrue(self._check(self.group))
+        # The user's cache depends on the group's version as well.
+        self.assertTrue(self._check())
+
+    def test_bulk_assign(self):
+        def group_check():
+            return self._check(Group.objects.get(pk=self.group.pk))
+
+        self.assertFalse(group_check())
+        UserPermission(group=self.group).bulk_assign(
+            check="delete_user", content_object=[self.user]
+        )
+        self.assertTrue(group_check())
+
+    def test_group_perms_shared_between_members(self):
+        UserPermission(group=self.group).assign(
+            check="change_user", content_object=self.user
+        )
+        member = User.objects.create(username="member", email="member@example.com")
+        self.group.user_set.add(member)
+        with self.settings(AUTHORITY_FULL_PRIME_THRESHOLD=0):
+            self.assertTrue(
+                UserPermission(self.user).has_perm(
+                    "user_permission.change_user", self.user
+                )
+            )
+            # The group permissions are loaded from the cache, only the
+            # permissions of the member itself are queried.
+            check = UserPermission(member)
+            self.assertEqual(check.check_strategy, "content_type")
+            with self.assertNumQueries(1) as queries:
+                self.assertTrue(
+                    check.has_perm("user_permission.change_user", self.user)
+                )
+        where = queries.captured_queries[0]["sql"].split("WHERE")[1]
+        self.assertNotIn("group_id", where)
+
+
+@override_settings(AUTHORITY_CACHE="authority")
+class SignalInvalidationTestCase(SharedCacheTestCase):
+    """
+    Tests that changes to permissions and group memberships invalidate the
+    shared cache automatically.
+    """
+
+    def test_permission_deleted(self):
+        self.assertTrue(self._check())
+        Permission.objects.filter(user=self.user).delete()
+        self.assertFalse(self._check())
+
+    def test_permission_saved(self):
+        self.assertTrue(self._check())
+        perm = Permission.objects.get(user=self.user)
+        perm.approved = False
+        perm.save()
+        self.assertFalse(self._check())
+        perm.approve(self.user)
+        self.assertTrue(self._check())
+
+    def test_permission_moved_to_group(self):
+        self.assertTrue(self._check())
+        other_group = Group.objects.create(name="other")
+        self.assertFalse(self._check(other_group))
+        perm = Permission.objects.get(user=self.user)
+        perm.user = None
+        perm.group = other_group
+        perm.save()
+        self.assertFalse(self._check())
+        self.assertTrue(self._check(Group.objects.get(pk=other_group.pk)))
+
+    def test_group_membership(self):
+        other_group = Group.objects.create(name="other")
+        UserPermission(group=other_group).assign(
+            check="change_user", content_object=self.user
+        )
+
+        def can_change():
+            check = UserPermission(User.objects.get(pk=self.user.pk))
+            return check.has_perm("user_permission.change_user", self.user)
+
+        self.assertFalse(can_change())
+        other_group.user_set.add(self.user)
+        self.assertTrue(can_change())
+        other_group.user_set.clear()
+        self.assertFalse(can_change())
+        self.user.groups.add(other_group)
+        self.assertTrue(can_change())
+        self.user.groups.remove(other_group)
+        self.assertFalse(can_change())
+
+    def test_bumped_on_commit(self):
+        permission_cache = get_permission_cache()
+        self.assertTrue(self._check())
+        version = permission_cache.get_versions("user", [self.user.pk])[self.user.pk]
+        # The transaction of the test is never committed.
+        connection.run_on_commit = []
+        Permission.objects.filter(user=self.user).delete()
+        bumped = permission_cache.get_versions("user", [self.user.pk])[self.user.pk]
+        self.assertNotEqual(bumped, version)
+        # Permissions cached by others before the commit, under the version
+        # bumped by the signal, are invalidated by the commit.
+        self.assertEqual(len(connection.run_on_commit), 1)
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for callback in callbacks:
+            callback[1]()
+        self.assertNotEqual(
+            permission_cache.get_versions("user", [self.user.pk])[self.user.pk],
+            bumped,
+        )
+
+
+class PermissionSetTestCase(TestCase):
+    """
+    Tests for the compact representation of primed permissions.
+    """
+
+    def setUp(self):
+        self.permission_set = PermissionSet()
+        for object_id in (5, 1, 3):
+            self.permission_set.add(object_id, 7, "poll_permission.change_poll", True)
+        self.permission_set.add(2, 7, "poll_permission.delete_poll", False)
+
+    def assertContainsKeys(self, permission_set):
+        self.assertTrue(permission_set.get((3, 7, "poll_permission.change_poll", True)))
+        self.assertIn((2, 7, "poll_permission.delete_poll", False), permission_set)
+        self.assertIsNone(
+            permission_set.get((2, 7, "poll_permission.change_poll", True))
+        )
+        self.assertNotIn((3, 7, "poll_permission.change_poll", False), permission_set)
+        self.assertNotIn((3, 8, "poll_permission.change_poll", True), permission_set)
+        self.assertEqual(len(permission_set), 4)
+
+    def test_lookup(self):
+        self.assertContainsKeys(self.permission_set)
+        self.assertContainsKeys(self.permission_set.freeze())
+
+    def test_lookup_non_integer(self):
+        permission_set = self.permission_set.freeze()
+        self.assertNotIn((None, 7, "poll_permission.change_poll", True), permission_set)
+        self.assertNotIn(("3", 7, "poll_permission.change_poll", True), permission_set)
+
+    def test_pickle(self):
+        unpickled = pickle.loads(pickle.dumps(self.permission_set))
+        self.assertContainsKeys(unpickled)
+        codenames = [key[2] for key in unpickled]
+        self.assertTrue(all(codename is codenames[0] for codename in codenames[:3]))
+
+
+class UnionPrimeTestCase(SmartCachingTestCase):
+    """
+    Tests that the user and group permissions are primed with a single query
+    that keeps them apart.
+    """
+
+    def test_prime_in_one_query(self):
+        UserPermission(self.user).assign(check="delete_user", content_object=self.user)
+        UserPermission(group=self.group).assign(
+            check="change_user", content_object=self.user
+        )
+        other_group = Group.objects.create(name="other")
+        UserPermission(group=other_group).assign(
+            check="browse_user", content_object=self.user
+        )
+        with self.assertNumQueries(1) as queries:
+            perm_cache, group_perm_caches = self.user_check._get_user_perm_caches_for(
+                Permission.objects.get_content_type(User).pk, True
+            )
+        self.assertIn("UNION ALL", queries.captured_queries[0]["sql"])
+        ct_pk = Permission.objects.get_content_type(User).pk
+        delete_key = (self.user.pk, ct_pk, "user_permission.delete_user", True)
+        change_key = (self.user.pk, ct_pk, "user_permission.change_user", True)
+        browse_key = (self.user.pk, ct_pk, "user_permission.browse_user", True)
+        self.assertIn(delete_key, perm_cache)
+        self.assertNotIn(change_key, perm_cache)
+        self.assertEqual(len(group_perm_caches), 1)
+        self.assertIn(change_key, group_perm_caches[0])
+        self.assertNotIn(delete_key, group_perm_caches[0])
+        self.assertNotIn(browse_key, group_perm_caches[0])
+
+    def test_unsaved_instance(self):
+        UserPermission(self.user).assign(check="delete_user", content_object=self.user)
+        check = UserPermission(User.objects.get(pk=self.user.pk))
+        unsaved = User(username="unsaved")
+        self.assertFalse(check.has_perm("user_permission.delete_user", unsaved))
+        self.assertFalse(check.delete_user(unsaved))
+        self.assertTrue(check.delete_user(self.user))
+
+
+@skipUnless(connection.vendor == "sqlite", "Checks SQLite query plans")
+class QueryPlanTestCase(TestCase):
+    """
+    Tests that the permission checks use the composite indexes.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.group = Group.objects.create(name="plans")
+        self.content_type = Permission.objects.get_content_type(User)
+
+    def get_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN %s" % sql, params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, queryset, index_names):
+        plan = " ".join(self.get_plan(queryset))
+        self.assertTrue(
+            any("USING COVERING INDEX %s" % name in plan for name in index_names)
+            or any("USING INDEX %s" % name in plan for name in index_names),
+            plan,
+        )
+
+    def test_prime(self):
+        perms = Permission.objects.filter(
+            content_type__pk=self.content_type.pk, approved=True
+        ).values_list("object_id", "content_type_id", "codename", "approved")
+        self.assertUsesIndex(
+            perms.filter(user__pk=self.user.pk), ["authority_perm_user_idx"]
+        )
+        self.assertUsesIndex(
+            perms.filter(group__pk__in=[self.group.pk]), ["authority_perm_group_idx"]
+        )
+
+    def test_user_permissions(self):
+        self.assertUsesIndex(
+            Permission.objects.for_user(self.user, self.user, check_groups=False),
+            ["authority_perm_user_idx"],
+        )
+        self.assertUsesIndex(
+            Permission.objects.group_permissions(
+                self.group, "user_permission.delete_user", self.user
+            ),
+            ["authority_perm_group_idx"],
+        )
+
+    def test_search(self):
+        queryset, _ = PermissionAdmin(Permission, admin.site).get_search_results(
+            None, Permission.objects.all(), "user_permission.delete"
+        )
+        plan = self.get_plan(queryset)
+        # Only the users and groups are scanned for their names.
+        self.assertNotIn("SCAN authority_permission", plan)
+        self.assertTrue(
+            [step for step in plan if "INDEX authority_perm_codename_idx (" in step],
+            plan,
+        )
+
+    def test_approved_index(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Permission._meta.db_table
+            )
+        self.assertEqual(
+            constraints["authority_perm_approved_idx"]["columns"],
+            ["content_type_id", "object_id", "codename"],
+        )
+
+    def test_for_object(self):
+        self.assertUsesIndex(
+            Permission.objects.for_object(self.user),
+            ["authority_perm_object_idx", "authority_perm_approved_idx"],
+        )
+        self.assertUsesIndex(
+            Permission.objects.for_object(self.user, approved=False),
+            ["authority_perm_object_idx"],
+        )
+
+
+class UncachedCheckTestCase(SmartCachingTestCase):
+    """
+    Tests the database queries of checks without the smart cache.
+    """
+
+    def setUp(self):
+        super(UncachedCheckTestCase, self).setUp()
+        settings.AUTHORITY_USE_SMART_CACHE = False
+        # Cache the content type.
+        Permission.objects.get_content_type(User)
+
+    def tearDown(self):
+        super(UncachedCheckTestCase, self).tearDown()
+        settings.AUTHORITY_USE_SMART_CACHE = True
+
+    def assertLeanExists(self, check, expected):
+        with self.assertNumQueries(1) as queries:
+            self.assertEqual(check(), expected)
+        sql = queries.captured_queries[0]["sql"]
+        self.assertNotIn("JOIN", sql)
+        self.assertIn("LIMIT 1", sql)
+
+    def test_user_perms(self):
+        def check():
+            return self.user_check.has_user_perms("foo", self.user, True)
+
+        self.assertLeanExists(check, False)
+        Permission.objects.create(
+            content_type=Permission.objects.get_content_type(User),
+            object_id=self.user.pk,
+            codename="foo",
+            group=self.group,
+            approved=True,
+        )
+        self.assertLeanExists(check, True)
+        self.assertFalse(
+            self.user_check.has_user_perms("foo", self.user, True, check_groups=False)
+        )
+
+    def test_group_perms(self):
+        def check():
+            return self.group_check.has_group_perms("foo", self.user, True)
+
+        self.assertLeanExists(check, False)
+        Permission.objects.create(
+            content_type=Permission.objects.get_content_type(User),
+            object_id=self.user.pk,
+            codename="foo",
+            group=self.group,
+            approved=True,
+        )
+        self.assertLeanExists(check, True)
+
+
+class CheckStrategyTestCase(SmartCachingTestCase):
+    """
+    Tests that the check strategy is chosen from the number of permissions.
+    """
+
+    def setUp(self):
+        super(CheckStrategyTestCase, self).setUp()
+        UserPermission(self.user).assign(check="delete_user", content_object=self.user)
+        GroupPermission(group=self.group).assign(
+            check="delete_group", content_object=self.group
+        )
+        # Cache the content types.
+        Permission.objects.get_content_type(User)
+        Permission.objects.get_content_type(Group)
+
+    def _checks(self):
+        return (
+            self.user_check.has_perm("user_permission.delete_user", self.user),
+            self.user_check.has_perm("group_permission.delete_group", self.group),
+            self.user_check.has_perm("user_permission.change_user", self.user),
+        )
+
+    def test_full(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.user_check.check_strategy, "full")
+        with self.assertNumQueries(0):
+            self.assertEqual(self._checks(), (True, True, False))
+
+    @override_settings(AUTHORITY_FULL_PRIME_THRESHOLD=1)
+    def test_content_type(self):
+        self.assertEqual(self.user_check.check_strategy, "content_type")
+        with self.assertNumQueries(2):
+            self.assertEqual(self._checks(), (True, True, False))
+        self.assertEqual(
+            sorted(self.user._authority_perm_cache_slices),
+            sorted(
+                [
+                    (Permission.objects.get_content_type(User).pk, True),
+                    (Permission.objects.get_content_type(Group).pk, True),
+                ]
+            ),
+        )
+
+    @override_settings(AUTHORITY_FULL_PRIME_THRESHOLD=0, AUTHORITY_PRIME_THRESHOLD=1)
+    def test_query(self):
+        self.assertEqual(self.user_check.check_strategy, "query")
+        with self.assertNumQueries(3):
+            self.assertEqual(self._checks(), (True, True, False))
+        self.assertEqual(self.user._authority_perm_cache_slices, {})
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.user_check.has_perm_for_objects(
+                    "user_permission.delete_user", [self.user]
+                ),
+                [True],
+            )
+
+    @override_settings(AUTHORITY_FULL_PRIME_THRESHOLD=0, AUTHORITY_PRIME_THRESHOLD=0)
+    def test_group(self):
+        self.assertEqual(self.group_check.check_strategy, "query")
+        self.assertTrue(
+            self.group_check.has_perm("group_permission.delete_group", self.group)
+        )
+
+    def test_chosen_once(self):
+        self.assertEqual(self.user_check.check_strategy, "full")
+        with self.settings(AUTHORITY_FULL_PRIME_THRESHOLD=0):
+            self.assertEqual(self.user_check.check_strategy, "full")
+            self.user_check.invalidate_permissions_cache()
+            self.assertEqual(self.user_check.check_strategy, "content_type")
+
+    def test_without_smart_cache(self):
+        settings.AUTHORITY_USE_SMART_CACHE = False
+        try:
+            self.assertEqual(self.user_check.check_strategy, "query")
+        finally:
+            settings.AUTHORITY_USE_SMART_CACHE = True
+
+
+class CompiledCheckTestCase(TestCase):
+    """
+    Tests the codenames precompiled when a permission class is registered.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.check = UserPermission(self.user)
+
+    def test_compiled_at_registration(self):
+        self.assertEqual(
+            UserPermission.compiled_checks[("delete", User, True)],
+            (
+                "user_permission.delete_user",
+                "%s.delete_user" % User._meta.app_label,
+            ),
+        )
+        for (check, model, generic), codenames in list(
+            UserPermission.compiled_checks.items()
+        ):
+            self.assertEqual(
+                codenames,
+                (
+                    self.check.get_codename(check, model, generic),
+                    self.check.get_django_codename(check, model, generic),
+                ),
+            )
+
+    def test_dispatch(self):
+        self.check.assign(check="delete_user", content_object=self.user)
+        self.assertTrue(self.check.delete_user(self.user))
+        self.assertFalse(self.check.change_user(self.user))
+
+    def test_subclass(self):
+        class SubPermission(UserPermission):
+            label = "sub_permission"
+
+        check = SubPermission(self.user)
+        self.assertEqual(
+            check.get_compiled_check("delete", User, True)[0],
+            "sub_permission.delete_user",
+        )
+        self.assertEqual(
+            self.check.get_compiled_check("delete", User, True)[0],
+            "user_permission.delete_user",
+        )
+
+
+    def test_custom_codename(self):
+        class CustomPermission(permissions.BasePermission):
+            label = "custom_permission"
+
+            def get_codename(self, check, model_or_instance, generic=False):
+                return "custom.%s" % check
+
+        site = authority.sites.site
+        site.register(DjangoPermission, CustomPermission)
+        try:
+            obj = DjangoPermission.objects.all()[0]
+            check = CustomPermission(self.user)
+            check.assign(check="delete", content_object=obj, generic=True)
+            codenames = Permission.objects.filter(user=self.user).values_list(
+                "codename", flat=True
+            )
+            self.assertEqual(list(codenames), ["custom.delete"])
+            self.assertTrue(CustomPermission(self.user).delete_permission(obj))
+        finally:
+            site.unregister(DjangoPermission)
+
+
+class PermissionSiteTestCase(TestCase):
+    """
+    Tests the label index and the resolution of checks by the site.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+
+    def test_label_index(self):
+        class IndexedPermission(permissions.BasePermission):
+            label = "indexed_permission"
+
+        site = authority.sites.site
+        self.assertIsNone(site.get_permission_by_label("indexed_permission"))
+        self.assertIsNone(site.get_check(self.user, "indexed_permission.add"))
+        site.register(DjangoPermission, IndexedPermission)
+        try:
+            self.assertIs(
+                site.get_permission_by_label("indexed_permission"), IndexedPermission
+            )
+            self.assertIn("indexed_permission", site.get_labels())
+            check = site.get_check(self.user, "indexed_permission.add_permission")
+            self.assertIsNotNone(check)
+        finally:
+            site.unregister(DjangoPermission)
+        self.assertIsNone(site.get_permission_by_label("indexed_permission"))
+        self.assertNotIn("indexed_permission", site.get_labels())
+        self.assertIsNone(
+            site.get_check(self.user, "indexed_permission.add_permission")
+        )
+
+    def test_instance_per_user(self):
+        check = authority.sites.get_check(self.user, "user_permission.delete_user")
+        other = authority.sites.get_check(self.user, "user_permission.browse_user")
+        self.assertIsInstance(check.__self__, UserPermission)
+        self.assertIs(check.__self__, other.__self__)
+        fresh_user = User.objects.get(pk=self.user.pk)
+        fresh = authority.sites.get_check(fresh_user, "user_permission.delete_user")
+        self.assertIsNot(check.__self__, fresh.__self__)
+        self.assertIs(fresh.__self__.user, fresh_user)
+
+    def test_unknown_check(self):
+        self.assertIsNone(authority.sites.get_check(self.user, "user_permission.foo"))
+        self.assertIsNone(authority.sites.get_check(self.user, "foo.delete_user"))
+
+
+class AppConfigTestCase(TestCase):
+    """
+    Tests the warm-up done when the app is ready.
+    """
+
+    def setUp(self):
+        self.app_config = apps.get_app_config("authority")
+        ContentType.objects.clear_cache()
+
+    def tearDown(self):
+        ContentType.objects.clear_cache()
+
+    def test_app_config(self):
+        self.assertIsInstance(self.app_config, AuthorityConfig)
+
+    def test_indexes(self):
+        authority.sites.site._checks.clear()
+        self.app_config.ready()
+        self.assertEqual(
+            authority.sites.site._checks["user_permission.delete_user"],
+            (UserPermission, "delete_user"),
+        )
+
+    def test_preload_content_types(self):
+        with self.settings(AUTHORITY_PRELOAD_CONTENT_TYPES=True):
+            with self.assertNumQueries(1):
+                self.app_config.ready()
+        with self.assertNumQueries(0):
+            ContentType.objects.get_for_model(User)
+            ContentType.objects.get_for_model(Group)
+
+
+class PermissionContextTestCase(TestCase):
+    """
+    Tests that the checks of a request share their permission instances and
+    primed caches.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        UserPermission(self.user).assign(check="delete_user", content_object=self.user)
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        # Cache the content type.
+        Permission.objects.get_content_type(User)
+
+    def test_middleware(self):
+        middleware = PermissionContextMiddleware(lambda request: request)
+        request = middleware(self.request)
+        self.assertIsInstance(request.permission_context, PermissionContext)
+        self.assertIs(get_permission_context(request), request.permission_context)
+
+    def test_same_user(self):
+        permission_context = get_permission_context(self.request)
+        reloaded = User.objects.get(pk=self.user.pk)
+        self.assertIs(permission_context.get_user(reloaded), self.user)
+        check = permission_context.get_check(reloaded, "user_permission.delete_user")
+        self.assertIs(check.__self__.user, self.user)
+        self.assertIs(
+            permission_context.get_permission(reloaded, UserPermission),
+            check.__self__,
+        )
+
+    def test_template_tags(self):
+        template = Template(
+            "{% load permissions %}"
+            '{% ifhasperm "user_permission.delete_user" request.user obj %}'
+            "yes{% endifhasperm %}"
+            '{% get_permission "user_permission.delete_user" for user and obj '
+            'as "granted" %}{{ granted }}'
+        )
+        context = Context(
+            {
+                "request": self.request,
+                "user": User.objects.get(pk=self.user.pk),
+                "obj": self.user,
+            }
+        )
+        # Django's permissions of the user and the authority permissions
+        # are loaded once for both tags.
+        with self.assertNumQueries(3):
+            self.assertEqual(template.render(context), "yesTrue")
+
+
+class BulkAssignTestCase(TestCase):
+    """
+    Tests assigning permissions in bulk.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.group = Group.objects.create(name="bulk")
+        self.users = [self.user] + [
+            User.objects.create(username="bulk%s" % i, email="bulk%s@example.com" % i)
+            for i in range(5)
+        ]
+        self.check = UserPermission(self.user)
+        # Cache the content type.
+        Permission.objects.get_content_type(User)
+
+    def test_bulk_assign(self):
+        with self.assertNumQueries(4):
+            # Two batches of an existence check and an insert each.
+            assigned = self.check.bulk_assign(
+                check=["delete_user", "change_user"],
+                content_object=self.users,
+                batch_size=3,
+            )
+        self.assertEqual(assigned, 12)
+        self.assertEqual(Permission.objects.filter(user=self.user).count(), 12)
+        self.assertTrue(self.check.delete_user(self.users[-1]))
+        self.assertTrue(self.check.change_user(self.user))
+        # Nothing is assigned twice.
+        self.assertEqual(
+            self.check.bulk_assign(
+                check=["delete_user", "change_user", "browse_user"],
+                content_object=User.objects.all(),
+            ),
+            len(self.users),
+        )
+        self.assertEqual(Permission.objects.filter(user=self.user).count(), 18)
+
+    def test_group(self):
+        check = UserPermission(group=self.group)
+        self.assertEqual(
+            check.bulk_assign(check="delete", content_object=self.users, generic=True),
+            len(self.users),
+        )
+        self.assertTrue(check.delete_user(self.users[1]))
+
+    def test_invalidates_cache(self):
+        self.assertFalse(self.check.delete_user(self.users[1]))
+        self.check.bulk_assign(check="delete_user", content_object=self.users)
+        self.assertTrue(self.check.delete_user(self.users[1]))
+
+    def test_django_permissions(self):
+        self.assertEqual(self.check.bulk_assign(check=["add_user", "foo_user"]), 2)
+        self.assertTrue(DjangoPermission.objects.filter(codename="foo_user").exists())
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(UserPermission(user).add_user())
+        self.assertEqual(self.check.bulk_assign(check=["add_user", "foo_user"]), 0)
+
+    def test_group_django_permissions(self):
+        group = Group.objects.create(name="bulk_models")
+        check = UserPermission(group=group)
+        self.assertEqual(check.bulk_assign(check="browse", content_object=User), 1)
+        self.assertTrue(
+            DjangoPermission.objects.filter(
+                group__pk=group.pk, codename="browse"
+            ).exists()
+        )
+        self.assertEqual(check.bulk_assign(check="browse", content_object=User), 0)
+
+    def test_exceptions(self):
+        with self.assertRaises(UnsavedModelInstance):
+            self.check.bulk_assign(content_object=[self.user, User()])
+        with self.assertRaises(NotAModel):
+            self.check.bulk_assign(content_object=[self.user, "fail"])
+        self.assertFalse(Permission.objects.exists())
+
+
+class RevokeTestCase(TestCase):
+    """
+    Tests revoking permissions in bulk.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.other = User.objects.create(username="other", email="other@example.com")
+        self.group = Group.objects.create(name="revoke")
+        self.users = [self.user, self.other]
+        UserPermission(self.user).bulk_assign(
+            check=["delete_user", "change_user"], content_object=self.users
+        )
+        UserPermission(self.other).bulk_assign(
+            check=["delete_user"], content_object=self.users
+        )
+        UserPermission(group=self.group).bulk_assign(
+            check=["delete_user"], content_object=self.users
+        )
+        # Cache the content type.
+        Permission.objects.get_content_type(User)
+
+    def test_revoke_user(self):
+        with self.assertNumQueries(4):
+            # Two chunks of a select and a delete each.
+            deleted = Permission.objects.revoke(users=[self.user], batch_size=3)
+        self.assertEqual(deleted, 4)
+        self.assertFalse(Permission.objects.filter(user=self.user).exists())
+        self.assertEqual(Permission.objects.count(), 4)
+
+    def test_revoke_codenames_and_objects(self):
+        deleted = Permission.objects.revoke(
+            users=[self.user.pk, self.other.pk],
+            groups=[self.group],
+            objects=[self.other],
+            codenames=["user_permission.delete_user"],
+        )
+        self.assertEqual(deleted, 3)
+        self.assertEqual(
+            Permission.objects.filter(object_id=self.other.pk).get().codename,
+            "user_permission.change_user",
+        )
+
+    def test_revoke_objects_queryset(self):
+        objects = User.objects.filter(pk=self.other.pk)
+        with self.assertNumQueries(2):
+            # A select and a delete, the users are filtered in a subquery.
+            deleted = Permission.objects.revoke(users=[self.user], objects=objects)
+        self.assertEqual(deleted, 2)
+        self.assertIsNone(objects._result_cache)
+        self.assertEqual(
+            set(
+                Permission.objects.filter(user=self.user).values_list(
+                    "object_id", flat=True
+                )
+            ),
+            set([self.user.pk]),
+        )
+
+    def test_revoke_nothing(self):
+        self.assertEqual(Permission.objects.revoke(users=[], objects=[]), 0)
+        self.assertEqual(Permission.objects.count(), 8)
+
+    def test_revoke_requires_arguments(self):
+        with self.assertRaises(ValueError):
+            Permission.objects.revoke()
+        with self.assertRaises(ValueError):
+            Permission.objects.revoke(approved=True)
+        self.assertEqual(Permission.objects.count(), 8)
+
+    def test_invalidates_shared_cache(self):
+        with self.settings(AUTHORITY_CACHE="authority"):
+            get_permission_cache().local.clear()
+            caches["authority"].clear()
+
+            def check():
+                user = User.objects.get(pk=self.user.pk)
+                return UserPermission(user).delete_user(self.other)
+
+            self.assertTrue(check())
+            Permission.objects.revoke(users=[self.user], groups=[self.group])
+            self.assertFalse(check())
+
+
+class ApproveTestCase(TestCase):
+    """
+    Tests approving permission requests in bulk.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.group = Group.objects.create(name="approve")
+        self.content_type = Permission.objects.get_content_type(User)
+        for principal in ({"user": self.user}, {"group": self.group}):
+            for codename in ("delete_user", "change_user"):
+                Permission.objects.create(
+                    content_type=self.content_type,
+                    object_id=self.user.pk,
+                    codename="user_permission.%s" % codename,
+                    approved=False,
+                    **principal
+                )
+
+    def test_approve(self):
+        approver = User.objects.create(username="approver", email="a@example.com")
+        self.assertFalse(UserPermission(self.user).delete_user(self.user))
+        with self.assertNumQueries(2):
+            self.assertEqual(Permission.objects.all().approve(approver), 4)
+        self.assertFalse(Permission.objects.filter(approved=False).exists())
+        self.assertFalse(
+            Permission.objects.exclude(creator=approver)
+            .exclude(date_approved=None)
+            .exists()
+        )
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(UserPermission(user).delete_user(self.user))
+        # Approved permissions are left alone.
+        self.assertEqual(Permission.objects.approve(self.user), 0)
+        self.assertEqual(Permission.objects.filter(creator=approver).count(), 4)
+
+    def test_admin_action(self):
+        messages = []
+
+        class TestPermissionAdmin(PermissionAdmin):
+            def message_user(self, request, message):
+                messages.append(message)
+
+        request = RequestFactory().post("/")
+        request.user = self.user
+        model_admin = TestPermissionAdmin(Permission, admin.site)
+        model_admin.approve_permissions(
+            request, Permission.objects.filter(user=self.user)
+        )
+        self.assertEqual(messages, ["2 permissions successfully approved."])
+        self.assertEqual(Permission.objects.filter(approved=False).count(), 2)
+
+    def test_invalidates_shared_cache(self):
+        with self.settings(AUTHORITY_CACHE="authority"):
+            get_permission_cache().local.clear()
+            caches["authority"].clear()
+
+            def check():
+                group = Group.objects.get(pk=self.group.pk)
+                return UserPermission(group=group).delete_user(self.user)
+
+            self.assertFalse(check())
+            Permission.objects.filter(group=self.group).approve(self.user)
+            self.assertTrue(check())
+
+
+class EditPermissionsActionTestCase(TestCase):
+    """
+    Tests the edit permissions admin action with many selected objects.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.user.is_superuser = True
+        self.content_type = Permission.objects.get_content_type(User)
+        self.users = [
+            User.objects.create(username="edit%s" % i, email="edit%s@example.com" % i)
+            for i in range(5)
+        ]
+        for user in self.users:
+            Permission.objects.create(
+                content_type=self.content_type,
+                object_id=user.pk,
+                codename="user_permission.delete_user",
+                user=user,
+                approved=True,
+            )
+        self.queryset = User.objects.filter(pk__in=[u.pk for u in self.users])
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+
+    def get_formsets(self, data=None):
+        inline = ActionPermissionInline(User, admin.site)
+        FormSet = inline.get_formset(self.request)
+        permissions = get_object_permissions(self.queryset)
+        return [
+            FormSet(
+                data=data,
+                instance=obj,
+                prefix="%s-%s" % (FormSet.get_default_prefix(), obj.pk),
+                permissions=permissions.get(obj.pk, []),
+            )
+            for obj in self.queryset
+        ]
+
+    def get_data(self):
+        data = {"post": "yes"}
+        for formset in self.get_formsets():
+            management_form = formset.management_form
+            for name in management_form.fields:
+                data[management_form.add_prefix(name)] = management_form[name].value()
+            for form in formset.initial_forms:
+                for name, field in form.fields.items():
+                    value = form[name].value()
+                    if value is None or value is False:
+                        continue
+                    keys = [form.add_prefix(name)]
+                    if field.show_hidden_initial:
+                        keys.append(form.add_initial_prefix(name))
+                    for key in keys:
+                        if hasattr(field.widget, "decompress"):
+                            for i, part in enumerate(field.widget.decompress(value)):
+                                data["%s_%s" % (key, i)] = "%s" % part
+                        else:
+                            data[key] = "%s" % value
+        return data
+
+    def test_render(self):
+        with self.assertNumQueries(5):
+            # The permissions, the objects, and the users, groups and
+            # creators to choose from are loaded once.
+            for formset in self.get_formsets():
+                for form in formset.forms + [formset.empty_form]:
+                    for field in form.fields.values():
+                        list(getattr(field, "choices", []))
+
+    def test_save(self):
+        data = self.get_data()
+        changed, deleted, unchanged = self.users[:3]
+        prefix = "authority-permission-content_type-object_id-%s" % changed.pk
+        data["%s-0-codename" % prefix] = "user_permission.change_user"
+        prefix = "authority-permission-content_type-object_id-%s" % deleted.pk
+        data["%s-0-DELETE" % prefix] = "on"
+        prefix = "authority-permission-content_type-object_id-%s" % unchanged.pk
+        data["%s-1-codename" % prefix] = "user_permission.change_user"
+        data["%s-1-user" % prefix] = "%s" % unchanged.pk
+        data["%s-1-date_requested_0" % prefix] = "2020-01-01"
+        data["%s-1-date_requested_1" % prefix] = "12:00:00"
+
+        request = RequestFactory().post("/", data)
+        request.user = self.user
+        model_admin = admin.site._registry[User]
+        # The permissions, the users to choose from, and a DELETE, UPDATE and
+        # INSERT for all the objects.
+        with self.assertNumQueries(5):
+            response = edit_permissions(model_admin, request, self.queryset)
+        self.assertEqual(response.status_code, 302)
+        perms = Permission.objects.filter(content_type=self.content_type)
+        self.assertEqual(
+            set(perms.filter(object_id=changed.pk).values_list("codename", flat=True)),
+            set(["user_permission.change_user"]),
+        )
+        self.assertFalse(perms.filter(object_id=deleted.pk).exists())
+        self.assertEqual(
+            set(
+                perms.filter(object_id=unchanged.pk).values_list("codename", "user")
+            ),
+            set(
+                [
+                    ("user_permission.delete_user", unchanged.pk),
+                    ("user_permission.change_user", unchanged.pk),
+                ]
+            ),
+        )
+        self.assertEqual(perms.filter(object_id__in=self.queryset).count(), 5)
+
+    def test_save_approved(self):
+        changed, added = self.users[:2]
+        Permission.objects.filter(object_id=changed.pk).update(
+            approved=False, date_approved=None
+        )
+        data = self.get_data()
+        prefix = "authority-permission-content_type-object_id-%s" % changed.pk
+        data["%s-0-approved" % prefix] = "on"
+        prefix = "authority-permission-content_type-object_id-%s" % added.pk
+        data["%s-1-codename" % prefix] = "user_permission.change_user"
+        data["%s-1-user" % prefix] = "%s" % added.pk
+        data["%s-1-approved" % prefix] = "on"
+        data["%s-1-date_requested_0" % prefix] = "2020-01-01"
+        data["%s-1-date_requested_1" % prefix] = "12:00:00"
+
+        request = RequestFactory().post("/", data)
+        request.user = self.user
+        edit_permissions(admin.site._registry[User], request, self.queryset)
+        perms = Permission.objects.filter(content_type=self.content_type)
+        changed_perm = perms.get(object_id=changed.pk)
+        self.assertTrue(changed_perm.approved)
+        self.assertIsNotNone(changed_perm.date_approved)
+        added_perm = perms.get(
+            object_id=added.pk, codename="user_permission.change_user"
+        )
+        self.assertTrue(added_perm.approved)
+        self.assertIsNotNone(added_perm.date_approved)
+
+
+@skipUnless(django.VERSION >= (2, 0), "get_changelist_instance requires Django 2.0")
+class PermissionChangeListTestCase(TestCase):
+    """
+    Tests the changelist of the permission admin.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.user.is_superuser = True
+        self.user.is_staff = True
+        self.user.username = "changelist"
+        self.user.save()
+        self.group = Group.objects.create(name="editors")
+        content_type = Permission.objects.get_content_type(User)
+        for codename in ("add_user", "browse_user", "change_user", "delete_user"):
+            Permission.objects.create(
+                content_type=content_type,
+                object_id=self.user.pk,
+                codename="user_permission.%s" % codename,
+                user=self.user,
+            )
+        Permission.objects.create(
+            content_type=content_type,
+            object_id=self.user.pk,
+            codename="user_permission.delete_user",
+            group=self.group,
+        )
+        self.pks = list(Permission.objects.order_by("-pk").values_list("pk", flat=True))
+        self.model_admin = PermissionAdmin(Permission, admin.site)
+        self.model_admin.list_per_page = 2
+
+    def get_changelist(self, **params):
+        request = RequestFactory().get("/", params)
+        request.user = self.user
+        return self.model_admin.get_changelist_instance(request)
+
+    def test_select_related(self):
+        changelist = self.get_changelist()
+        self.assertEqual(
+            changelist.queryset.query.select_related,
+            {"content_type": {}, "user": {}, "group": {}},
+        )
+
+    def test_keyset_pagination(self):
+        changelist = self.get_changelist()
+        self.assertEqual([perm.pk for perm in changelist.result_list], self.pks[:2])
+        self.assertEqual(changelist.keyset_next_url, "?before=%s" % self.pks[1])
+
+        changelist = self.get_changelist(before=self.pks[1])
+        self.assertEqual([perm.pk for perm in changelist.result_list], self.pks[2:4])
+        self.assertEqual(changelist.keyset_next_url, "?before=%s" % self.pks[3])
+
+        changelist = self.get_changelist(before=self.pks[3])
+        self.assertEqual([perm.pk for perm in changelist.result_list], self.pks[4:])
+        self.assertIsNone(changelist.keyset_next_url)
+
+    def test_keyset_pagination_sorted(self):
+        # Sorted by a column, the "before" parameter is ignored.
+        changelist = self.get_changelist(o="1", before=self.pks[1])
+        self.assertEqual(len(changelist.result_list), 2)
+        self.assertIsNone(changelist.keyset_next_url)
+
+    def test_estimated_count(self):
+        paginator = EstimatedCountPaginator(Permission.objects.order_by("pk"), 2)
+        paginator.count_limit = 3
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.count_limited)
+        paginator = EstimatedCountPaginator(
+            Permission.objects.filter(group=self.group).order_by("pk"), 2
+        )
+        self.assertEqual(paginator.count, 1)
+        self.assertFalse(paginator.count_limited)
+
+    def test_limited_count_label(self):
+        self.model_admin.paginator = type(
+            "LimitedPaginator", (EstimatedCountPaginator,), {"count_limit": 3}
+        )
+        changelist = self.get_changelist(q="user_permission")
+        rendered = Template(
+            "{% include 'admin/authority/permission/pagination.html' %}"
+        ).render(Context({"cl": changelist}))
+        self.assertIn("3+ permissions", " ".join(rendered.split()))
+
+    def test_search(self):
+        changelist = self.get_changelist(q="user_permission.delete")
+        self.assertEqual(
+            set(perm.pk for perm in changelist.queryset), set(self.pks[:2])
+        )
+        changelist = self.get_changelist(q="_permission.delete")
+        self.assertFalse(changelist.queryset.exists())
+        # Users and groups are searched by a part of their names.
+        changelist = self.get_changelist(q="EDIT")
+        self.assertEqual([perm.pk for perm in changelist.queryset], self.pks[:1])
+        changelist = self.get_changelist(q="angeli")
+        self.assertEqual(len(changelist.queryset), 4)
+        changelist = self.get_changelist(q="angeli user_permission.add")
+        self.assertEqual(len(changelist.queryset), 1)
+
+
+class ContentObjectsTestCase(TestCase):
+    """
+    Tests resolving the content objects of many permissions at once.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.users = [
+            User.objects.create(username="obj%s" % i, email="obj%s@example.com" % i)
+            for i in range(3)
+        ]
+        self.groups = [Group.objects.create(name="obj%s" % i) for i in range(3)]
+        for obj in self.users + self.groups:
+            Permission.objects.create(
+                content_type=Permission.objects.get_content_type(obj),
+                object_id=obj.pk,
+                codename="user_permission.delete_user",
+                user=self.user,
+                approved=True,
+            )
+        self.objects = set(self.users + self.groups)
+
+    def test_with_content_objects(self):
+        # The permissions, and the users and groups.
+        with self.assertNumQueries(3):
+            perms = Permission.objects.filter(user=self.user).with_content_objects()
+            self.assertEqual(set(perm.content_object for perm in perms), self.objects)
+
+    def test_resolve_content_objects(self):
+        perms = list(Permission.objects.filter(user=self.user))
+        with self.assertNumQueries(2):
+            perms = Permission.objects.resolve_content_objects(perms)
+            self.assertEqual(set(perm.content_object for perm in perms), self.objects)
+
+    def test_template_tag(self):
+        template = Template(
+            "{% load permissions %}{% get_permissions obj as 'perms' %}"
+            "{% for perm in perms %}{{ perm.content_object.pk }},{% endfor %}"
+        )
+        for obj in self.users + self.groups:
+            Permission.objects.create(
+                content_type=Permission.objects.get_content_type(obj),
+                object_id=obj.pk,
+                codename="user_permission.change_user",
+                user=self.user,
+                approved=True,
+            )
+        obj = self.users[0]
+        with self.assertNumQueries(2):
+            rendered = template.render(Context({"obj": obj}))
+        self.assertEqual(rendered, "%s,%s," % (obj.pk, obj.pk))
+
+    @skipUnless(
+        django.VERSION >= (2, 0), "get_changelist_instance requires Django 2.0"
+    )
+    def test_admin_changelist(self):
+        self.user.is_superuser = True
+        request = RequestFactory().get("/")
+        request.user = self.user
+        changelist = PermissionAdmin(Permission, admin.site).get_changelist_instance(
+            request
+        )
+        with self.assertNumQueries(3):
+            self.assertEqual(
+                set(perm.content_object for perm in changelist.result_list),
+                self.objects,
+            )
+
+
+class PermissionDescriptorTestCase(TestCase):
+    """
+    Tests the permissions of registered model instances.
+    """
+
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.user = User.objects.get(QUERY)
+        self.users = [
+            User.objects.create(username="desc%s" % i, email="desc%s@example.com" % i)
+            for i in range(3)
+        ]
+        content_type = Permission.objects.get_content_type(User)
+        for user in self.users[:2]:
+            for codename in ("delete_user", "change_user"):
+                Permission.objects.create(
+                    content_type=content_type,
+                    object_id=user.pk,
+                    codename="user_permission.%s" % codename,
+                    user=self.user,
+                    approved=codename == "delete_user",
+                )
+
+    def test_instance_permissions(self):
+        perms = self.users[0].permissions.all()
+        self.assertEqual(len(perms), 2)
+        self.assertTrue(all(perm.object_id == self.users[0].pk for perm in perms))
+        self.assertEqual(self.users[0].permissions.filter(approved=True).count(), 1)
+        self.assertFalse(self.users[2].permissions.exists())
+
+    def test_iterate(self):
+        user = self.users[0]
+        self.assertEqual(len(user.permissions), 2)
+        self.assertEqual(
+            set(perm.codename for perm in user.permissions),
+            set(["user_permission.delete_user", "user_permission.change_user"]),
+        )
+        self.assertEqual(user.permissions[0].object_id, user.pk)
+        self.assertTrue(user.permissions)
+        self.assertFalse(self.users[2].permissions)
+
+    def test_prefetch_related(self):
+        pks = [user.pk for user in self.users]
+        with self.assertNumQueries(2):
+            users = User.objects.filter(pk__in=pks).order_by("pk")
+            users = list(users.prefetch_related("permissions"))
+            self.assertEqual(
+                [len(user.permissions.all()) for user in users], [2, 2, 0]
+            )
+            self.assertEqual([len(user.permissions) for user in users], [2, 2, 0])
+
+    def test_prefetch_queryset(self):
+        pks = [user.pk for user in self.users]
+        with self.assertNumQueries(2):
+            approved = Permission.objects.filter(approved=True)
+            users = User.objects.filter(pk__in=pks).order_by("pk")
+            users = list(
+                users.prefetch_related(Prefetch("permissions", queryset=approved))
+            )
+            self.assertEqual(
+                [
+                    [perm.codename for perm in user.permissions.all()]
+                    for user in users
+                ],
+                [["user_permission.delete_user"]] * 2 + [[]],
+            )
+
+
+if django.VERSION >= (3, 1):
+    # The async tests are a syntax error on Python 2.
+    from authority.async_tests import AsyncPermissionTestCase  # noqa
@@ -5,6 +5,7 @@ from django.utils.translation import ugettext as _
 from django.template import loader
 from django.contrib.auth.decorators import login_required
 
+from authority.context import get_permission_context
 from authority.models import Permission
 from authority.forms import UserPermissionForm
 from authority.templatetags.permissions import url_for_obj
@@ -56,6 +57,8 @@ def add_permission(
             perm=codename,
             initial=dict(codename=codename),
         )
+        # Attached afterwards, custom form classes may not take it.
+        form.permission_context = get_permission_context(request)
         if not approved:
             # Limit permission request to current user
             form.data["user"] = request.user
@@ -67,8 +70,12 @@ def add_permission(
             return HttpResponseRedirect(next)
     else:
         form = form_class(
-            obj=obj, approved=approved, perm=codename, initial=dict(codename=codename)
+            obj=obj,
+            approved=approved,
+            perm=codename,
+            initial=dict(codename=codename),
         )
+        form.permission_context = get_permission_context(request)
     context = {
         "form": form,
         "form_url": url_for_obj(view_name, obj),
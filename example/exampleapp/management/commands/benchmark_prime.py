@@ -0,0 +1,100 @@
+from __future__ import print_function
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from authority.models import Permission
+from authority.permissions import BasePermission
+
+
+class Rollback(Exception):
+    pass
+
+
+def prime_with_instances(user):
+    """
+    The smart cache prime as it was done before, building a model instance
+    for every permission row.
+    """
+    user_permissions = {}
+    for perm in Permission.objects.filter(user__pk=user.pk):
+        user_permissions[
+            (perm.object_id, perm.content_type_id, perm.codename, perm.approved)
+        ] = True
+    return user_permissions
+
+
+def prime_with_values(user):
+    """
+    The smart cache prime streaming the columns with values_list.
+    """
+    return BasePermission(user)._load_cached_perms(user.pk)[0]
+
+
+class Command(BaseCommand):
+    help = "Compares the time it takes to prime the smart cache of a user."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            nargs="+",
+            default=[10000, 100000, 1000000],
+            help="Number of permissions of the user to prime.",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3, help="Best time of this many runs."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(options["rows"], options["repeat"])
+                # Don't keep any of the benchmark data.
+                raise Rollback
+        except Rollback:
+            pass
+
+    def benchmark(self, sizes, repeat):
+        User = get_user_model()
+        user = User.objects.create(
+            username="benchmark", email="benchmark-prime@example.com"
+        )
+        content_type = Permission.objects.get_content_type(User)
+        codenames = ["user_permission.change_user", "user_permission.delete_user"]
+        created = 0
+        self.stdout.write(
+            "%10s %14s %14s %8s" % ("rows", "instances (s)", "values (s)", "speedup")
+        )
+        for size in sorted(sizes):
+            Permission.objects.bulk_create(
+                (
+                    Permission(
+                        user=user,
+                        content_type=content_type,
+                        object_id=index // len(codenames),
+                        codename=codenames[index % len(codenames)],
+                        approved=True,
+                    )
+                    for index in range(created, size)
+                ),
+                batch_size=5000,
+            )
+            created = size
+            timings = []
+            for prime in (prime_with_instances, prime_with_values):
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    primed = prime(user)
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                assert len(primed) == size
+                timings.append(best)
+            self.stdout.write(
+                "%10d %14.3f %14.3f %7.1fx"
+                % (size, timings[0], timings[1], timings[0] / timings[1])
+            )
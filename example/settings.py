@@ -22,7 +22,10 @@ DATABASES = {
     }
 }
 
-CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache",}}
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache",},
+    "authority": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",},
+}
 
 TIME_ZONE = "America/Chicago"
 